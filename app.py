@@ -1,11 +1,36 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, Response, g, render_template, request, jsonify, send_file, send_from_directory, url_for
 from flask_cors import CORS
 import os
+import atexit
 import json
-import base64
-from datetime import datetime
+import itertools
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+from functools import lru_cache, partial
 from pathlib import Path
 
+from werkzeug.http import is_resource_modified
+
+from chart_extract import ChartExtractor, describe as describe_charts
+from compression import SUFFIXES, compress, negotiate
+from history_store import HistoryStore, WriteBehindHistory, new_record_id
+from image_preprocess import ImagePreprocessor, image_pixels
+from image_store import ImageStore, UploadRejected, UploadSpool
+from job_queue import JobQueue, QueueFull
+from markdown_render import RenderCache
+from metrics import BYTES_BUCKETS, Registry
+from model_backend import BackendError, ClaudeBackend
+from profiling import RequestProfiler
+from result_cache import DiskBackend, MemoryBackend, ResultCache, make_key
+from retention import RetentionManager
+from single_flight import SingleFlight
+from template_registry import TemplateError, TemplateRegistry
+from static_assets import DIST_DIR, build as build_assets, load_manifest
+
 app = Flask(__name__)
 CORS(app)
 
@@ -13,15 +38,256 @@ CORS(app)
 UPLOAD_FOLDER = 'uploads'
 DATA_FOLDER = 'data'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('UPLOAD_MAX_REQUEST_MB', 16)) * 1024 * 1024  # 单个请求上限
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get('UPLOAD_MAX_FILE_MB', 10)) * 1024 * 1024  # 单个图片上限
+# 单个图片的像素上限：高压缩比的图片（如纯色大图）文件很小，解码后却占用大量内存
+UPLOAD_MAX_PIXELS = int(float(os.environ.get('UPLOAD_MAX_MEGAPIXELS', 40)) * 1000 * 1000)
 
 # 确保目录存在
 Path(UPLOAD_FOLDER).mkdir(exist_ok=True)
 Path(DATA_FOLDER).mkdir(exist_ok=True)
 
+# 上传图片按内容哈希去重存储，base64 编码结果缓存在内存中
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_MB', 64)) * 1024 * 1024
+
+image_store = ImageStore(UPLOAD_FOLDER, cache_max_bytes=IMAGE_CACHE_MAX_BYTES)
+
+# 分析前的图片预处理：缩放到最长边、重新编码、去除元数据（需要 Pillow）
+IMAGE_PREPROCESS = os.environ.get('IMAGE_PREPROCESS', '1') == '1'
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', 1568))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'webp')
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 85))
+
+image_preprocessor = ImagePreprocessor(
+    os.path.join(UPLOAD_FOLDER, 'derived'),
+    max_edge=IMAGE_MAX_EDGE,
+    fmt=IMAGE_FORMAT,
+    quality=IMAGE_QUALITY
+) if IMAGE_PREPROCESS else None
+
+
+class UploadRequest(Request):
+    """上传文件边接收边写入上传目录，不在内存中缓冲整个请求体"""
+
+    max_form_memory_size = 1024 * 1024  # 单个文本字段上限（自定义模板等）
+    max_form_parts = 1000
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = UploadSpool(UPLOAD_FOLDER, UPLOAD_MAX_FILE_BYTES)
+        self.__dict__.setdefault('_upload_spools', []).append(spool)
+        return spool
+
+    def close(self):
+        # 解析中途被拒绝时 files 尚未生成，需要自行清理临时文件
+        super().close()
+        for spool in self.__dict__.get('_upload_spools', []):
+            spool.close()
+
+
+app.request_class = UploadRequest
+
+# 分析结果缓存：RESULT_CACHE_BACKEND 可选 memory / disk / off
+RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 24 * 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 1000))
+
+if RESULT_CACHE_BACKEND == 'disk':
+    result_cache = ResultCache(
+        DiskBackend(os.path.join(DATA_FOLDER, 'result_cache.db'), max_entries=RESULT_CACHE_MAX_ENTRIES),
+        ttl=RESULT_CACHE_TTL
+    )
+elif RESULT_CACHE_BACKEND == 'memory':
+    result_cache = ResultCache(MemoryBackend(max_entries=RESULT_CACHE_MAX_ENTRIES), ttl=RESULT_CACHE_TTL)
+else:
+    result_cache = None
+
+# 历史记录存储（SQLite），首次启动时自动导入旧版 history.json
+HISTORY_DB = os.environ.get('HISTORY_DB', os.path.join(DATA_FOLDER, 'history.db'))
+LEGACY_HISTORY_FILE = os.path.join(DATA_FOLDER, 'history.json')
+HISTORY_MIGRATE_JSON = os.environ.get('HISTORY_MIGRATE_JSON', '1') == '1'
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
+SEARCH_PAGE_SIZE = 20
+# 增量同步每次最多返回的变更条数
+HISTORY_CHANGES_MAX = 500
+
+history_store = HistoryStore(HISTORY_DB)
+
+if HISTORY_MIGRATE_JSON and os.path.exists(LEGACY_HISTORY_FILE):
+    try:
+        history_store.migrate_json(LEGACY_HISTORY_FILE, only_if_empty=True)
+        os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + '.migrated')
+    except FileNotFoundError:
+        # 其它 worker 已完成导入并重命名了文件
+        pass
+
+# 报告模板注册表：分析请求通过 template_id_<类型> 引用已保存的模板，不必每次上传模板内容
+TEMPLATE_DB = os.environ.get('TEMPLATE_DB', os.path.join(DATA_FOLDER, 'templates.db'))
+TEMPLATE_MAX_CHARS = int(os.environ.get('TEMPLATE_MAX_CHARS', 20000))
+
+template_registry = TemplateRegistry(TEMPLATE_DB, max_chars=TEMPLATE_MAX_CHARS)
+
+# 写回模式：保存历史时只放入内存队列，后台按批量/时间窗口分组写入，
+# 进程崩溃时最多丢失 HISTORY_FLUSH_INTERVAL 秒内的记录
+HISTORY_WRITE_BEHIND = os.environ.get('HISTORY_WRITE_BEHIND', '0') == '1'
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', 0.2))
+HISTORY_FLUSH_BATCH = int(os.environ.get('HISTORY_FLUSH_BATCH', 100))
+
+if HISTORY_WRITE_BEHIND:
+    history_store = WriteBehindHistory(
+        history_store, max_batch=HISTORY_FLUSH_BATCH, max_delay=HISTORY_FLUSH_INTERVAL
+    )
+    atexit.register(history_store.close)
+
+# 保留策略：超过 RETENTION_DAYS 天或超出 HISTORY_MAX_RECORDS 条的旧记录归档到 data/archive/，
+# 未被引用且超过 UPLOAD_GC_GRACE 秒的上传图片被回收；RETENTION_INTERVAL 为后台执行间隔（秒，0 表示不自动执行）
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 0))
+HISTORY_MAX_RECORDS = int(os.environ.get('HISTORY_MAX_RECORDS', 0))
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 0))
+RETENTION_IO_BYTES_PER_SEC = int(float(os.environ.get('RETENTION_IO_MB_PER_SEC', 5)) * 1024 * 1024)
+UPLOAD_GC_GRACE = int(os.environ.get('UPLOAD_GC_GRACE', 3600))
+
+retention = RetentionManager(
+    history_store, UPLOAD_FOLDER, os.path.join(DATA_FOLDER, 'archive'),
+    retention_days=RETENTION_DAYS, max_records=HISTORY_MAX_RECORDS,
+    upload_grace=UPLOAD_GC_GRACE, io_bytes_per_sec=RETENTION_IO_BYTES_PER_SEC
+)
+if RETENTION_INTERVAL:
+    retention.start(RETENTION_INTERVAL)
+
+# 相同分析合并：同一组图片 + 风格 + 补充说明 + 模板同时只调用一次模型，
+# COALESCE_ACROSS_WORKERS=1 时通过 data/inflight/ 下的锁文件在 gunicorn worker 之间合并
+COALESCE_ACROSS_WORKERS = os.environ.get('COALESCE_ACROSS_WORKERS', '1') == '1'
+
+analysis_flight = SingleFlight(
+    lock_dir=os.path.join(DATA_FOLDER, 'inflight') if COALESCE_ACROSS_WORKERS else None
+)
+
 # Claude API 配置
 CLAUDE_API_KEY = os.environ.get('CLAUDE_API_KEY', '')
 
+# 并发分析配置：全局线程池大小、单个请求最多同时进行的风格分析数
+ANALYZE_POOL_SIZE = int(os.environ.get('ANALYZE_POOL_SIZE', 16))
+ANALYZE_CONCURRENCY = int(os.environ.get('ANALYZE_CONCURRENCY', 4))
+
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYZE_POOL_SIZE, thread_name_prefix='analyze')
+
+# 模型后端配置：未设置 CLAUDE_API_KEY 时使用演示结果；CLAUDE_API_URL 可指向 mock_server.py
+# 超时与总时限需远低于 gunicorn 的 --timeout（300 秒）；限流为每个进程每秒请求数
+CLAUDE_API_URL = os.environ.get('CLAUDE_API_URL', 'https://api.anthropic.com')
+CLAUDE_MODEL = os.environ.get('CLAUDE_MODEL', 'claude-sonnet-4-5')
+CLAUDE_MAX_TOKENS = int(os.environ.get('CLAUDE_MAX_TOKENS', 2048))
+MODEL_TIMEOUT = float(os.environ.get('MODEL_TIMEOUT', 60))
+MODEL_DEADLINE = float(os.environ.get('MODEL_DEADLINE', 120))
+MODEL_RATE_LIMIT = float(os.environ.get('MODEL_RATE_LIMIT', 5))
+MODEL_MAX_RETRIES = int(os.environ.get('MODEL_MAX_RETRIES', 3))
+MODEL_BREAKER_THRESHOLD = int(os.environ.get('MODEL_BREAKER_THRESHOLD', 5))
+MODEL_BREAKER_RESET = float(os.environ.get('MODEL_BREAKER_RESET', 30))
+
+model_backend = None
+if CLAUDE_API_KEY:
+    model_backend = ClaudeBackend(
+        CLAUDE_API_KEY, base_url=CLAUDE_API_URL, model=CLAUDE_MODEL, max_tokens=CLAUDE_MAX_TOKENS,
+        timeout=MODEL_TIMEOUT, deadline=MODEL_DEADLINE, pool_size=ANALYZE_POOL_SIZE,
+        rate_limit=MODEL_RATE_LIMIT, max_retries=MODEL_MAX_RETRIES,
+        breaker_threshold=MODEL_BREAKER_THRESHOLD, breaker_reset=MODEL_BREAKER_RESET
+    )
+# 结果缓存键包含生成结果的后端：演示结果不会在配置密钥后被当作真实分析返回，更换模型或参数后也不复用旧结果
+MODEL_IDENTITY = f'{CLAUDE_MODEL}:{CLAUDE_MAX_TOKENS}' if model_backend is not None else 'demo'
+
+# 运行指标（/metrics，Prometheus 文本格式，按进程统计）
+metrics = Registry(prefix='trend_analyzer_')
+http_request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'HTTP 请求处理耗时（流式接口只统计到开始响应）', ('endpoint', 'method', 'status')
+)
+stage_seconds = metrics.histogram('stage_duration_seconds', '请求处理各阶段耗时', ('stage',))
+analysis_seconds = metrics.histogram('analysis_duration_seconds', '单次模型分析耗时', ('style', 'outcome'))
+upload_bytes = metrics.counter('upload_bytes', '接收的上传图片字节数')
+upload_size_bytes = metrics.histogram('upload_size_bytes', '单个上传图片大小', buckets=BYTES_BUCKETS)
+preprocess_bytes = metrics.counter('preprocess_bytes', '预处理前后的图片字节数', ('kind',))
+encoded_bytes = metrics.counter('encoded_image_bytes', '发送给模型的 base64 图片字节数')
+metrics.gauge(
+    'result_cache_requests', '分析结果缓存查询次数',
+    lambda: {('hit',): result_cache.hits, ('miss',): result_cache.misses} if result_cache else None,
+    ('result',), kind='counter'
+)
+metrics.gauge(
+    'image_cache_requests', '图片编码缓存查询次数',
+    lambda: {('hit',): image_store.hits, ('miss',): image_store.misses}, ('result',), kind='counter'
+)
+metrics.gauge(
+    'markdown_cache_requests', '旧记录 Markdown 渲染缓存查询次数',
+    lambda: {('hit',): markdown_cache.hits, ('miss',): markdown_cache.misses}, ('result',), kind='counter'
+)
+metrics.gauge(
+    'analysis_calls', '分析调用次数（executed 实际调用模型，其余为合并复用）',
+    lambda: {
+        ('executed',): analysis_flight.executed,
+        ('coalesced',): analysis_flight.coalesced,
+        ('coalesced_across_workers',): analysis_flight.coalesced_remote
+    }, ('kind',), kind='counter'
+)
+metrics.gauge('history_records', '在线历史记录数', lambda: history_store.count())
+metrics.gauge('job_queue_depth', '排队中的异步任务数', lambda: job_queue.depth())
+metrics.gauge(
+    'model_circuit_open', '模型后端熔断状态（1 为熔断中）',
+    lambda: int(model_backend.breaker.state == 'open') if model_backend else None
+)
+
+# 按请求的性能记录（默认关闭，关闭时不注册任何钩子）：带 X-Profile: 1 请求头或 ?profile=1 的请求、
+# 以及分析接口按 PROFILE_SAMPLE_RATE 抽样的请求会被记录到 data/profiles/；
+# PROFILE_MODE 为 cprofile（.pstats）或 sample（折叠栈，可生成火焰图）
+PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+# 流式接口、异步任务在响应返回后才执行分析，记录最多等待它们这么久（秒）再保存
+PROFILE_BACKGROUND_WAIT = float(os.environ.get('PROFILE_BACKGROUND_WAIT', 600))
+
+request_profiler = None
+if PROFILE_ENABLED:
+    request_profiler = RequestProfiler(os.path.join(DATA_FOLDER, 'profiles'), mode=PROFILE_MODE, keep=PROFILE_KEEP)
+
+# 响应压缩：客户端支持时，不小于 COMPRESS_MIN_BYTES 的 JSON 响应按 br（需安装 Brotli）或 gzip 压缩
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.environ['COMPRESS_LEVEL']) if os.environ.get('COMPRESS_LEVEL') else None
+
+# 本地趋势图数据提取（需要 NumPy）：从简单的折线图、柱状图中提取数值序列和趋势统计，
+# 附加到每条分析结果的 charts 字段；CHART_LOCAL_CONCISE=1 时，简洁风格（concise_*）在所有图片
+# 都提取成功且没有自定义模板时直接由统计结果生成，不调用模型
+CHART_EXTRACT = os.environ.get('CHART_EXTRACT', '1') == '1'
+CHART_LOCAL_CONCISE = os.environ.get('CHART_LOCAL_CONCISE', '0') == '1'
+
+chart_extractor = ChartExtractor() if CHART_EXTRACT else None
+
+# 分析结果在服务端渲染为 HTML 并随记录保存；旧记录按内容哈希渲染并缓存最近 MARKDOWN_CACHE_SIZE 条
+MARKDOWN_CACHE_SIZE = int(os.environ.get('MARKDOWN_CACHE_SIZE', 512))
+
+markdown_cache = RenderCache(MARKDOWN_CACHE_SIZE)
+
+# 静态资源：启动时生成带内容哈希的预压缩副本（static/dist/），页面引用它们并设置一年的 immutable 缓存；
+# 只读文件系统上可设 STATIC_BUILD_ON_START=0，改为在构建镜像时执行 python static_assets.py
+STATIC_BUILD_ON_START = os.environ.get('STATIC_BUILD_ON_START', '1') == '1'
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+asset_manifest = build_assets(app.static_folder) if STATIC_BUILD_ON_START else load_manifest(app.static_folder)
+
+# 异步任务配置：工作线程数、排队上限、结果保留时间（秒）
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', 20))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))
+# worker 退出时等待排队中和执行中任务完成的最长时间（秒），gunicorn 的 graceful_timeout 默认比它多 10 秒
+JOB_SHUTDOWN_TIMEOUT = float(os.environ.get('JOB_SHUTDOWN_TIMEOUT', 150))
+
+# 批量分析配置：单次最多分组数、共享线程池上的并发上限
+BATCH_MAX_GROUPS = int(os.environ.get('BATCH_MAX_GROUPS', 100))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+
+# 流式接口的心跳间隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+
 # 分析风格配置
 ANALYSIS_STYLES = {
     'formal_tech': {
@@ -76,9 +342,11 @@ ANALYSIS_STYLES = {
 
 
 def encode_image(image_path):
-    """将图片编码为base64"""
-    with open(image_path, 'rb') as f:
-        return base64.standard_b64encode(f.read()).decode('utf-8')
+    """将图片编码为base64（按内容哈希缓存）"""
+    with stage_seconds.time(stage='encode_image'):
+        encoded = image_store.encode(image_path)
+    encoded_bytes.inc(len(encoded))
+    return encoded
 
 
 def get_image_media_type(file_path):
@@ -94,9 +362,50 @@ def get_image_media_type(file_path):
     return media_types.get(ext, 'image/jpeg')
 
 
-def analyze_with_claude(image_paths, style_key, user_context='', custom_template=''):
-    """使用 Claude API 分析图片 - 演示版本"""
-    # 演示版本：返回预设的分析结果
+@lru_cache(maxsize=256)
+def compile_prompt(style_key, custom_template=''):
+    """风格与模板组合的固定部分，每种组合只构造一次"""
+    style_config = ANALYSIS_STYLES.get(style_key, ANALYSIS_STYLES['formal_tech'])
+    prompt = style_config['prompt']
+    if custom_template:
+        prompt += f"\n\n请严格按照以下模板格式输出：\n{custom_template}"
+    return prompt
+
+
+def build_prompt(style_key, user_context='', custom_template=''):
+    """根据分析风格、补充说明和自定义模板构造提示词"""
+    prompt = compile_prompt(style_key, custom_template)
+    if user_context:
+        prompt += f"\n\n用户补充说明：\n{user_context}"
+    return prompt + "\n\n请使用 Markdown 格式输出。"
+
+
+def analyze_with_claude(image_paths, style_key, user_context='', custom_template='', on_delta=None):
+    """使用 Claude API 分析图片；未配置 API 密钥时返回演示结果
+
+    on_delta 为可选的增量文本回调，传入时使用流式输出并逐段调用它。
+    """
+    if model_backend is None:
+        return demo_analysis(style_key, user_context, custom_template)
+
+    style_config = ANALYSIS_STYLES.get(style_key, ANALYSIS_STYLES['formal_tech'])
+    images = [(get_image_media_type(path), encode_image(path)) for path in image_paths]
+    try:
+        analysis_text = model_backend.analyze(
+            images, build_prompt(style_key, user_context, custom_template), on_delta=on_delta
+        )
+    except BackendError as e:
+        return {'error': e.message, 'style': style_config['name']}
+
+    return {
+        'success': True,
+        'analysis': analysis_text,
+        'style': style_config['name']
+    }
+
+
+def demo_analysis(style_key, user_context='', custom_template=''):
+    """演示版本：返回预设的分析结果"""
     style_config = ANALYSIS_STYLES.get(style_key, ANALYSIS_STYLES['formal_tech'])
 
     # 根据不同风格返回不同的演示分析
@@ -693,76 +1002,369 @@ def analyze_with_claude(image_paths, style_key, user_context='', custom_template
     }
 
 
-def save_history(images, analyses, user_context, name=''):
-    """保存分析历史"""
-    history_file = os.path.join(DATA_FOLDER, 'history.json')
+def save_uploads(files):
+    """保存上传的图片（相同内容只保存一份），返回存储路径列表"""
+    saved = []
+    with stage_seconds.time(stage='upload_save'):
+        for file in files:
+            if file:
+                saved.append(image_store.save(file))
+
+    for path in saved:
+        size = os.path.getsize(path)
+        upload_bytes.inc(size)
+        upload_size_bytes.observe(size)
+        pixels = image_pixels(path)
+        if pixels is not None and pixels > UPLOAD_MAX_PIXELS:
+            raise UploadRejected(f'单个图片不能超过 {UPLOAD_MAX_PIXELS // 10000} 万像素', 413)
+    return saved
+
+
+def prepare_images(image_paths):
+    """分析前预处理图片，返回 (用于分析的路径列表, 字节统计)"""
+    original_bytes = sum(os.path.getsize(path) for path in image_paths)
+    with stage_seconds.time(stage='preprocess'):
+        if image_preprocessor is None:
+            prepared = list(image_paths)
+        else:
+            prepared = [image_preprocessor.prepare(path, image_store.digest_of(path)) for path in image_paths]
+
+    processed_bytes = sum(os.path.getsize(path) for path in prepared)
+    preprocess_bytes.inc(original_bytes, kind='original')
+    preprocess_bytes.inc(processed_bytes, kind='processed')
+    return prepared, {
+        'original_bytes': original_bytes,
+        'processed_bytes': processed_bytes,
+        'saved_bytes': original_bytes - processed_bytes
+    }
+
+
+def with_html(analysis):
+    """为成功的分析结果补充渲染好的 HTML（已有时原样返回）"""
+    if 'html' in analysis or not analysis.get('analysis'):
+        return analysis
+    with stage_seconds.time(stage='render_markdown'):
+        return dict(analysis, html=markdown_cache.render(analysis['analysis']))
+
+
+def extract_charts(image_paths):
+    """每张图片的数据提取结果（无法识别的为 None）；未启用时返回 None"""
+    if chart_extractor is None or not chart_extractor.enabled:
+        return None
+    with stage_seconds.time(stage='chart_extract'):
+        return [chart_extractor.extract(path, image_store.digest_of(path)) for path in image_paths]
+
+
+def local_analysis(style_key, charts):
+    """根据提取的数据直接生成分析（不调用模型）"""
+    style_config = ANALYSIS_STYLES.get(style_key, ANALYSIS_STYLES['formal_tech'])
+    return {
+        'success': True,
+        'analysis': describe_charts(charts, style_config['name']),
+        'style': style_config['name'],
+        'source': 'local'
+    }
 
-    # 读取现有历史
-    if os.path.exists(history_file):
-        with open(history_file, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-    else:
-        history = []
 
-    # 添加新记录
-    record = {
-        'id': datetime.now().strftime('%Y%m%d_%H%M%S'),
-        'timestamp': datetime.now().isoformat(),
-        'name': name or f"分析_{datetime.now().strftime('%Y-%m-%d %H:%M')}",
+def cached_analyze(image_paths, style_key, user_context='', custom_template='', use_cache=True,
+                   on_delta=None):
+    """带结果缓存的分析；use_cache=False 时跳过读取缓存，但仍会刷新缓存
+
+    缓存未命中时，相同参数的并发分析合并为一次模型调用。
+    结果附带每张图片的数据提取结果（charts）。
+    """
+    charts = extract_charts(image_paths)
+    result = _cached_analyze(image_paths, style_key, user_context, custom_template, use_cache, on_delta, charts)
+    return dict(result, charts=charts) if charts is not None and 'error' not in result else result
+
+
+def _cached_analyze(image_paths, style_key, user_context, custom_template, use_cache, on_delta, charts):
+    if (CHART_LOCAL_CONCISE and style_key.startswith('concise_') and not custom_template
+            and charts and all(charts)):
+        started = time.perf_counter()
+        result = with_html(local_analysis(style_key, charts))
+        analysis_seconds.observe(time.perf_counter() - started, style=style_key, outcome='local')
+        return result
+
+    key = make_key(
+        [image_store.digest_of(path) for path in image_paths],
+        style_key, user_context, custom_template, MODEL_IDENTITY
+    )
+    if use_cache and result_cache is not None:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return with_html(cached)
+
+    def compute(emit):
+        started = time.perf_counter()
+        result = analyze_with_claude(image_paths, style_key, user_context, custom_template, emit)
+        analysis_seconds.observe(
+            time.perf_counter() - started, style=style_key, outcome='error' if 'error' in result else 'success'
+        )
+        if 'error' not in result:
+            result = with_html(result)
+            if result_cache is not None:
+                result_cache.set(key, result)
+        return result
+
+    result, _ = analysis_flight.do(key, compute, on_delta)
+    return result
+
+
+def run_tasks(tasks, max_concurrency=None, use_cache=True, on_result=None, on_delta=None,
+              cancel_event=None, fail_fast=True):
+    """在共享线程池上并发执行分析任务
+
+    tasks 为 (image_paths, style_key, user_context, custom_template) 列表，
+    最多同时运行 max_concurrency 个，结果按 tasks 顺序返回。
+    fail_fast 时任一分析失败即取消尚未开始的分析，返回 (None, 错误结果)；
+    否则失败结果原样放在对应位置。成功返回 (结果列表, None)。
+
+    on_result(index, result) 在每个分析完成时立即调用，
+    on_delta(index, text) 转发模型的增量输出；
+    cancel_event 被设置后不再提交新的分析（用于客户端断开）。
+    """
+    limit = max(1, min(max_concurrency or ANALYZE_CONCURRENCY, len(tasks)))
+    results = [None] * len(tasks)
+    pending = {}
+    next_index = 0
+    # 当前请求正在记录性能时，线程池中的分析一并记录
+    analyze_fn = request_profiler.bind(cached_analyze) if request_profiler else cached_analyze
+
+    def submit_next():
+        nonlocal next_index
+        image_paths, style_key, user_context, custom_template = tasks[next_index]
+        future = analysis_executor.submit(
+            analyze_fn, image_paths, style_key, user_context, custom_template, use_cache,
+            partial(on_delta, next_index) if on_delta else None
+        )
+        pending[future] = next_index
+        next_index += 1
+
+    while next_index < len(tasks) and len(pending) < limit:
+        submit_next()
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'error': f'分析失败: {e}'}
+
+            if 'error' in result and fail_fast:
+                # 已在运行的分析无法中断，结果直接丢弃
+                for other in pending:
+                    other.cancel()
+                return None, result
+            results[index] = result
+            if on_result:
+                on_result(index, result)
+
+        if cancel_event is not None and cancel_event.is_set():
+            for other in pending:
+                other.cancel()
+            return None, {'error': '分析已取消'}
+
+        while next_index < len(tasks) and len(pending) < limit:
+            submit_next()
+
+    return results, None
+
+
+def run_analyses(image_paths, jobs, user_context='', max_concurrency=None, use_cache=True,
+                 on_result=None, on_delta=None, cancel_event=None):
+    """并发执行同一组图片的多个风格分析
+
+    jobs 为 (style_key, custom_template) 列表，任一分析失败即整体失败，
+    其余参数见 run_tasks。
+    """
+    tasks = [(image_paths, style_key, user_context, custom_template) for style_key, custom_template in jobs]
+    return run_tasks(
+        tasks, max_concurrency, use_cache,
+        on_result=on_result, on_delta=on_delta, cancel_event=cancel_event
+    )
+
+
+def build_history_record(images, analyses, user_context, name=''):
+    """构造一条历史记录"""
+    now = datetime.now()
+    return {
+        'id': new_record_id(),
+        'timestamp': now.isoformat(),
+        'name': name or f"分析_{now.strftime('%Y-%m-%d %H:%M')}",
         'images': images,
         'user_context': user_context,
         'analyses': analyses
     }
 
-    history.insert(0, record)  # 最新的在前面
 
-    # 保存历史
-    with open(history_file, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
-
-    return record['id']
+def save_history(images, analyses, user_context, name=''):
+    """保存分析历史"""
+    with stage_seconds.time(stage='save_history'):
+        return history_store.insert(build_history_record(images, analyses, user_context, name))
 
 
-def get_history():
-    """获取历史记录"""
-    history_file = os.path.join(DATA_FOLDER, 'history.json')
-    if os.path.exists(history_file):
-        with open(history_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+def _parse_history_date(value, end_of_day=False):
+    """校验日期参数并转为可与 timestamp 比较的 ISO 字符串"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        # 只给日期时，包含当天全部记录
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed.isoformat()
 
 
 def delete_history(record_id):
     """删除历史记录"""
-    history_file = os.path.join(DATA_FOLDER, 'history.json')
-    if os.path.exists(history_file):
-        with open(history_file, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-
-        history = [h for h in history if h['id'] != record_id]
-
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-        return True
-    return False
+    return history_store.delete(record_id)
 
 
 def update_history_name(record_id, new_name):
     """更新历史记录名称"""
-    history_file = os.path.join(DATA_FOLDER, 'history.json')
-    if os.path.exists(history_file):
-        with open(history_file, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-
-        for h in history:
-            if h['id'] == record_id:
-                h['name'] = new_name
-                break
-
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-        return True
-    return False
+    return history_store.rename(record_id, new_name)
+
+
+def _run_analysis_job(params, progress):
+    """异步任务：执行全部风格分析并保存历史"""
+    total = len(params['jobs'])
+    completed = 0
+
+    def on_result(index, result):
+        nonlocal completed
+        completed += 1
+        progress(completed, total)
+
+    analyses, error = run_analyses(
+        params['analysis_images'], params['jobs'], params['user_context'],
+        use_cache=params['use_cache'], on_result=on_result
+    )
+    if error:
+        raise RuntimeError(error['error'])
+
+    history_id = save_history(params['images'], analyses, params['user_context'], params['name'])
+    return {'analyses': analyses, 'history_id': history_id, 'preprocess': params['preprocess']}
+
+
+job_queue = JobQueue(
+    os.path.join(DATA_FOLDER, 'jobs.db'),
+    _run_analysis_job,
+    workers=JOB_WORKERS,
+    max_queue=JOB_QUEUE_MAX,
+    result_ttl=JOB_RESULT_TTL
+)
+atexit.register(job_queue.close, JOB_SHUTDOWN_TIMEOUT)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method, status=response.status_code
+        )
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """按 Accept-Encoding 压缩较大的 JSON 响应（流式响应和文件下载不处理）"""
+    if (not COMPRESS_ENABLED or response.mimetype != 'application/json' or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = negotiate(request.accept_encodings) if len(data) >= COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return response
+    with stage_seconds.time(stage='compress'):
+        response.set_data(compress(data, encoding, COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.context_processor
+def inject_asset_url():
+    def asset_url(filename):
+        """静态资源地址：已构建时指向带内容哈希的副本"""
+        hashed = asset_manifest.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('hashed_asset', filename=hashed)
+
+    return {'asset_url': asset_url}
+
+
+def _profile_authorized():
+    """设置了 PROFILE_TOKEN 时，请求需带相同的 X-Profile-Token 请求头或 token 参数"""
+    return not PROFILE_TOKEN or request.headers.get('X-Profile-Token', request.args.get('token')) == PROFILE_TOKEN
+
+
+def start_profile():
+    requested = request.headers.get('X-Profile', request.args.get('profile')) == '1'
+    if requested:
+        if not _profile_authorized():
+            return
+    elif not (request.path.startswith('/api/analyze') and random.random() < PROFILE_SAMPLE_RATE):
+        return
+    mode = request.headers.get('X-Profile-Mode', request.args.get('profile_mode'))
+    g.profile = request_profiler.begin(mode if mode in ('cprofile', 'sample') else None)
+
+
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    session, token = profile
+    meta = {'method': request.method, 'path': request.path, 'status': response.status_code}
+    if not session.busy:
+        response.headers['X-Profile-Id'] = request_profiler.finish(session, token, meta)
+        return response
+
+    # 分析仍在后台线程中执行（流式接口、异步任务）：响应结束后等待它们完成再保存
+    profile_id = request_profiler.new_id()
+    response.headers['X-Profile-Id'] = profile_id
+    request_profiler.detach(session, token)
+    response.call_on_close(lambda: threading.Thread(
+        target=request_profiler.save, args=(session, meta, profile_id),
+        kwargs={'wait': PROFILE_BACKGROUND_WAIT}, name='profile-save', daemon=True
+    ).start())
+    return response
+
+
+def abort_profile(exc):
+    # after_request 未执行（如请求中途出错）时也要结束记录
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.finish(*profile, {'method': request.method, 'path': request.path, 'status': 500})
+
+
+if request_profiler is not None:
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(abort_profile)
+
+
+@app.errorhandler(UploadRejected)
+def handle_upload_rejected(e):
+    """上传内容不合法（格式不支持、单个文件或图片尺寸过大）"""
+    return jsonify({'error': e.message}), e.status
+
+
+@app.errorhandler(413)
+def handle_request_too_large(e):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'error': f'上传内容不能超过 {limit_mb}MB'}), 413
 
 
 @app.route('/')
@@ -771,6 +1373,23 @@ def index():
     return render_template('index.html')
 
 
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """带内容哈希的静态资源：优先返回预压缩的副本，可永久缓存"""
+    dist = os.path.join(app.static_folder, DIST_DIR)
+    encoding = negotiate(request.accept_encodings)
+    if encoding is not None and os.path.isfile(os.path.join(dist, filename + SUFFIXES[encoding])):
+        response = send_from_directory(dist, filename + SUFFIXES[encoding], max_age=STATIC_MAX_AGE)
+        response.mimetype = 'text/css' if filename.endswith('.css') else 'text/javascript'
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(dist, filename, max_age=STATIC_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/api/styles', methods=['GET'])
 def get_styles():
     """获取所有分析风格"""
@@ -778,58 +1397,578 @@ def get_styles():
     return jsonify({'styles': styles})
 
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze():
-    """分析图片接口"""
-    if 'images' not in request.files:
-        return jsonify({'error': '没有上传图片'}), 400
+def resolve_template(template_id, content=''):
+    """分析使用的模板内容：给出 id 时从注册表读取（不存在返回 None），否则使用上传的内容"""
+    if template_id:
+        return template_registry.content(template_id)
+    return content
 
-    files = request.files.getlist('images')
+
+def _parse_analyze_request():
+    """解析分析请求并保存上传图片
+
+    返回 (参数字典, None)，参数不合法时返回 (None, 错误响应)。
+    """
+    # 首次访问 request.files 时解析整个 multipart 请求体（上传文件边接收边写入临时文件）
+    with stage_seconds.time(stage='multipart_parse'):
+        uploads = request.files
+    if 'images' not in uploads:
+        return None, (jsonify({'error': '没有上传图片'}), 400)
+
+    files = uploads.getlist('images')
     style_keys = request.form.getlist('styles')
-    user_context = request.form.get('context', '')
-    save_name = request.form.get('name', '')
 
     if not files or files[0].filename == '':
-        return jsonify({'error': '没有选择文件'}), 400
+        return None, (jsonify({'error': '没有选择文件'}), 400)
 
     if not style_keys:
-        return jsonify({'error': '没有选择分析风格'}), 400
-
-    # 保存上传的图片
-    saved_images = []
-    for file in files:
-        if file:
-            filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            saved_images.append(filepath)
-
-    # 对每种风格进行分析
-    analyses = []
+        return None, (jsonify({'error': '没有选择分析风格'}), 400)
+
+    jobs = []
     for style_key in style_keys:
-        # 检查是否有对应的自定义模板
+        # 检查是否有对应的自定义模板：优先使用已保存模板的 id，兼容直接上传模板内容
         template_key = style_key.replace('_report', '')
-        custom_template = request.form.get(f'template_{template_key}', '')
+        custom_template = resolve_template(
+            request.form.get(f'template_id_{template_key}'), request.form.get(f'template_{template_key}', '')
+        )
+        if custom_template is None:
+            return None, (jsonify({'error': f'模板不存在: {template_key}', 'code': 'template_not_found'}), 400)
+        jobs.append((style_key, custom_template))
+
+    saved_images = save_uploads(files)
 
-        result = analyze_with_claude(saved_images, style_key, user_context, custom_template)
-        if 'error' in result:
-            return jsonify(result), 500
-        analyses.append(result)
+    # 预处理后的图片用于分析，历史记录仍保存原图
+    analysis_images, preprocess_stats = prepare_images(saved_images)
+
+    return {
+        'images': saved_images,
+        'analysis_images': analysis_images,
+        'preprocess': preprocess_stats,
+        'jobs': jobs,
+        'user_context': request.form.get('context', ''),
+        'name': request.form.get('name', ''),
+        'use_cache': request.form.get('no_cache', '') not in ('1', 'true')
+    }, None
+
+
+@app.route('/api/templates', methods=['GET'])
+def list_templates():
+    """已保存的报告模板（最近更新的在前），参数 type 按类型筛选"""
+    return jsonify({'templates': template_registry.list(request.args.get('type') or None)})
+
+
+@app.route('/api/templates', methods=['POST'])
+def create_template():
+    """保存报告模板：{type, content, name}，相同内容返回相同 id"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体应为 JSON 对象'}), 400
+    try:
+        template = template_registry.create(data.get('type', ''), data.get('content', ''), data.get('name', ''))
+    except TemplateError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'template': template}), 201
+
+
+@app.route('/api/templates/<template_id>', methods=['GET'])
+def get_template(template_id):
+    """获取单个报告模板"""
+    template = template_registry.get(template_id)
+    if template is None:
+        return jsonify({'error': '模板不存在', 'code': 'template_not_found'}), 404
+    return jsonify({'template': template})
+
+
+@app.route('/api/templates/<template_id>', methods=['PUT'])
+def update_template(template_id):
+    """修改报告模板的类型、名称或内容；内容变化时返回新的 id，原模板保留"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体应为 JSON 对象'}), 400
+    try:
+        template = template_registry.update(
+            template_id, data.get('type'), data.get('content'), data.get('name')
+        )
+    except TemplateError as e:
+        return jsonify({'error': str(e)}), 400
+    if template is None:
+        return jsonify({'error': '模板不存在', 'code': 'template_not_found'}), 404
+    return jsonify({'template': template})
+
+
+@app.route('/api/templates/<template_id>', methods=['DELETE'])
+def delete_template(template_id):
+    """删除报告模板"""
+    if template_registry.delete(template_id):
+        return jsonify({'success': True})
+    return jsonify({'error': '模板不存在', 'code': 'template_not_found'}), 404
+
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze():
+    """分析图片接口"""
+    params, error_response = _parse_analyze_request()
+    if error_response:
+        return error_response
+
+    # 对每种风格进行分析（并发执行，结果保持请求顺序）
+    analyses, error = run_analyses(
+        params['analysis_images'], params['jobs'], params['user_context'], use_cache=params['use_cache']
+    )
+    if error:
+        return jsonify(error), 500
 
     # 保存历史
-    history_id = save_history(saved_images, analyses, user_context, save_name)
+    history_id = save_history(params['images'], analyses, params['user_context'], params['name'])
 
     return jsonify({
         'success': True,
         'analyses': analyses,
-        'history_id': history_id
+        'history_id': history_id,
+        'preprocess': params['preprocess']
     })
 
 
+def _sse_event(event, data):
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """流式分析接口（Server-Sent Events）
+
+    参数与 /api/analyze 相同。事件依次为：
+    start（风格列表）、delta（模型增量文本，后端支持时）、
+    result（单个风格完成）、error 或 done（含 history_id）。
+    """
+    params, error_response = _parse_analyze_request()
+    if error_response:
+        return error_response
+
+    events = queue.Queue()
+    cancel_event = threading.Event()
+
+    def worker():
+        try:
+            analyses, error = run_analyses(
+                params['analysis_images'], params['jobs'], params['user_context'],
+                use_cache=params['use_cache'],
+                on_result=lambda index, result: events.put(('result', {'index': index, **result})),
+                on_delta=lambda index, text: events.put(('delta', {'index': index, 'text': text})),
+                cancel_event=cancel_event
+            )
+            if error:
+                events.put(('error', error))
+            else:
+                history_id = save_history(params['images'], analyses, params['user_context'], params['name'])
+                events.put(('done', {'success': True, 'history_id': history_id}))
+        except Exception as e:
+            events.put(('error', {'error': f'分析失败: {e}'}))
+        finally:
+            events.put(None)
+
+    def generate():
+        yield _sse_event('start', {
+            'styles': [
+                {'key': style_key, 'name': ANALYSIS_STYLES.get(style_key, ANALYSIS_STYLES['formal_tech'])['name']}
+                for style_key, _ in params['jobs']
+            ],
+            'preprocess': params['preprocess']
+        })
+        try:
+            while True:
+                try:
+                    item = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # 心跳注释行，防止代理断开空闲连接
+                    yield ': keepalive\n\n'
+                    continue
+                if item is None:
+                    break
+                yield _sse_event(*item)
+        finally:
+            # 客户端断开时停止提交剩余分析
+            cancel_event.set()
+
+    threading.Thread(target=RequestProfiler.bind_background(worker), daemon=True).start()
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def _parse_batch_request():
+    """解析批量分析请求并保存上传图片
+
+    groups 字段为 JSON 列表，每组 {name, styles, context, templates, template_ids}，
+    第 i 组的图片放在 images_<i> 字段中。
+    返回 (分组列表, None)，参数不合法时返回 (None, 错误响应)。
+    """
+    with stage_seconds.time(stage='multipart_parse'):
+        form = request.form
+    try:
+        groups = json.loads(form.get('groups', ''))
+    except ValueError:
+        return None, (jsonify({'error': 'groups 参数格式错误'}), 400)
+
+    if not isinstance(groups, list) or not groups:
+        return None, (jsonify({'error': '没有分析分组'}), 400)
+    if len(groups) > BATCH_MAX_GROUPS:
+        return None, (jsonify({'error': f'单次最多 {BATCH_MAX_GROUPS} 个分组'}), 400)
+
+    # 先检查全部分组，参数都合法后再保存图片
+    checked = []
+    for index, group in enumerate(groups):
+        error = _check_batch_group(group)
+        if error:
+            return None, (jsonify({'error': f'第 {index + 1} 组{error}'}), 400)
+
+        files = [f for f in request.files.getlist(f'images_{index}') if f and f.filename]
+        if not files:
+            return None, (jsonify({'error': f'第 {index + 1} 组缺少图片'}), 400)
+
+        templates = group.get('templates') or {}
+        template_ids = group.get('template_ids') or {}
+        jobs = []
+        for style_key in group['styles']:
+            template_key = style_key.replace('_report', '')
+            custom_template = resolve_template(template_ids.get(template_key), templates.get(template_key, ''))
+            if custom_template is None:
+                return None, (jsonify({
+                    'error': f'第 {index + 1} 组模板不存在: {template_key}', 'code': 'template_not_found'
+                }), 400)
+            jobs.append((style_key, custom_template))
+        checked.append((group, files, jobs))
+
+    prepared = []
+    for group, files, jobs in checked:
+        images = save_uploads(files)
+        analysis_images, preprocess_stats = prepare_images(images)
+        prepared.append({
+            'name': group.get('name') or '',
+            'user_context': group.get('context') or '',
+            'images': images,
+            'analysis_images': analysis_images,
+            'preprocess': preprocess_stats,
+            'jobs': jobs
+        })
+    return prepared, None
+
+
+def _check_batch_group(group):
+    """检查批量分析的一个分组，返回错误说明，合法时返回 None"""
+    if not isinstance(group, dict):
+        return '格式错误'
+    styles = group.get('styles')
+    if not isinstance(styles, list) or not styles:
+        return '缺少分析风格（styles 应为风格列表）'
+    unknown = [style for style in styles if not isinstance(style, str) or style not in ANALYSIS_STYLES]
+    if unknown:
+        return f'分析风格不存在: {unknown[0]}'
+    for field in ('templates', 'template_ids'):
+        value = group.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, dict) or not all(isinstance(v, str) for v in value.values()):
+            return f'的 {field} 应为 {{模板类型: 字符串}} 对象'
+    for field in ('name', 'context'):
+        if group.get(field) is not None and not isinstance(group[field], str):
+            return f'的 {field} 应为字符串'
+    return None
+
+
+def run_batch(groups, use_cache=True, on_group=None):
+    """执行批量分析：所有 分组×风格 共享一个有界线程池
+
+    每组全部风格完成后调用 on_group(分组结果)；
+    成功的分组在最后一次性写入历史。返回分组结果列表。
+    """
+    tasks = []
+    owners = []
+    for group_index, group in enumerate(groups):
+        for style_key, custom_template in group['jobs']:
+            tasks.append((group['analysis_images'], style_key, group['user_context'], custom_template))
+            owners.append(group_index)
+
+    remaining = [len(group['jobs']) for group in groups]
+    group_results = [None] * len(groups)
+    task_results = [None] * len(tasks)
+    offsets = list(itertools.accumulate([0] + remaining[:-1]))
+
+    def on_result(index, result):
+        task_results[index] = result
+        group_index = owners[index]
+        remaining[group_index] -= 1
+        if remaining[group_index]:
+            return
+
+        group = groups[group_index]
+        analyses = task_results[offsets[group_index]:offsets[group_index] + len(group['jobs'])]
+        errors = [a['error'] for a in analyses if 'error' in a]
+        group_result = {'index': group_index, 'name': group['name'], 'preprocess': group['preprocess']}
+        if errors:
+            group_result.update({'success': False, 'error': errors[0]})
+        else:
+            group_result.update({'success': True, 'analyses': analyses})
+        group_results[group_index] = group_result
+        if on_group:
+            on_group(group_result)
+
+    run_tasks(tasks, BATCH_CONCURRENCY, use_cache, on_result=on_result, fail_fast=False)
+
+    # 成功的分组在一个事务中写入历史
+    records = []
+    for group, group_result in zip(groups, group_results):
+        if group_result['success']:
+            record = build_history_record(
+                group['images'], group_result['analyses'], group['user_context'], group['name']
+            )
+            group_result['history_id'] = record['id']
+            records.append(record)
+    if records:
+        with stage_seconds.time(stage='save_history'):
+            history_store.insert_many(records)
+    return group_results
+
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """批量分析接口
+
+    一次提交多组图片，每组有各自的风格、补充说明和模板。
+    默认返回全部分组结果；format=ndjson（或 Accept: application/x-ndjson）时
+    每组完成即输出一行 JSON，最后一行为 {"type": "done", "history_ids": ...}。
+    """
+    groups, error_response = _parse_batch_request()
+    if error_response:
+        return error_response
+
+    use_cache = request.form.get('no_cache', '') not in ('1', 'true')
+    stream = (request.form.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+
+    if not stream:
+        group_results = run_batch(groups, use_cache)
+        return jsonify({'success': True, 'groups': group_results})
+
+    lines = queue.Queue()
+
+    def worker():
+        try:
+            group_results = run_batch(
+                groups, use_cache, on_group=lambda result: lines.put({'type': 'group', **result})
+            )
+            lines.put({
+                'type': 'done',
+                'history_ids': {r['index']: r['history_id'] for r in group_results if r['success']}
+            })
+        except Exception as e:
+            lines.put({'type': 'error', 'error': f'分析失败: {e}'})
+        finally:
+            lines.put(None)
+
+    def generate():
+        while True:
+            line = lines.get()
+            if line is None:
+                break
+            yield json.dumps(line, ensure_ascii=False) + '\n'
+
+    threading.Thread(target=RequestProfiler.bind_background(worker), daemon=True).start()
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """提交异步分析任务，参数与 /api/analyze 相同，立即返回任务 id"""
+    params, error_response = _parse_analyze_request()
+    if error_response:
+        return error_response
+
+    try:
+        job_id = job_queue.submit(
+            params, total=len(params['jobs']), runner=RequestProfiler.bind_background(_run_analysis_job)
+        )
+    except QueueFull:
+        response = jsonify({'error': '任务队列已满，请稍后重试'})
+        response.headers['Retry-After'] = '10'
+        return response, 429
+
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/api/jobs/{job_id}'
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询异步任务进度与结果"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """获取结果缓存、图片编码缓存与请求合并的统计信息"""
+    return jsonify({
+        'result_cache': result_cache.stats() if result_cache else None,
+        'image_cache': {'hits': image_store.hits, 'misses': image_store.misses},
+        'coalescing': analysis_flight.stats()
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式的运行指标（本进程）"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """已保存的性能记录列表"""
+    if request_profiler is None:
+        return jsonify({'error': '性能记录未开启'}), 404
+    if not _profile_authorized():
+        return jsonify({'error': '无权访问'}), 403
+    return jsonify({'profiles': request_profiler.list()})
+
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """下载性能记录文件（.pstats 或 .collapsed）"""
+    if request_profiler is None:
+        return jsonify({'error': '性能记录未开启'}), 404
+    if not _profile_authorized():
+        return jsonify({'error': '无权访问'}), 403
+    path = request_profiler.path_of(profile_id)
+    if path is None:
+        return jsonify({'error': '记录不存在'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=os.path.basename(path))
+
+
+def _history_response(build):
+    """按历史数据版本处理条件请求：版本未变化时返回 304，不执行查询
+
+    build(version) 生成响应；ETag 与 Last-Modified 都来自存储的版本号，
+    多个 worker 共享同一数据库，因此各 worker 给出的 ETag 一致。
+    写回模式下有尚未写入的记录时，ETag 附加本进程的新增序号，不为此刷新队列。
+    """
+    etag, changed_at, version = history_store.cache_tag()
+    last_modified = datetime.fromtimestamp(changed_at, timezone.utc) if changed_at else None
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        response = app.make_response(build(version))
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    # 允许浏览器缓存，但每次使用前都要向服务端确认
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route('/api/history', methods=['GET'])
 def history():
-    """获取历史记录"""
-    return jsonify({'history': get_history()})
+    """分页获取历史记录摘要
+
+    参数：limit（每页条数）、cursor（上一页返回的 next_cursor）、
+    name（名称包含）、since / until（ISO 日期或时间）
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_PAGE_MAX)
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+        since = _parse_history_date(request.args.get('since'))
+        until = _parse_history_date(request.args.get('until'), end_of_day=True)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+
+    def build(version):
+        summaries, next_cursor = history_store.list_summaries(
+            limit=limit,
+            cursor=cursor,
+            name=request.args.get('name', '').strip(),
+            since=since,
+            until=until
+        )
+        return jsonify({
+            'history': summaries,
+            'next_cursor': str(next_cursor) if next_cursor is not None else None,
+            'version': version
+        })
+
+    return _history_response(build)
+
+
+@app.route('/api/history/changes', methods=['GET'])
+def history_changes():
+    """增量同步：返回版本 since 之后的新增、重命名和删除
+
+    同一记录的多次变更只返回最后一次；reset 为 true 时客户端需重新加载完整列表，
+    has_more 为 true 时以返回的 version 继续请求。
+    """
+    try:
+        since = int(request.args.get('since', ''))
+        limit = min(max(int(request.args.get('limit', HISTORY_CHANGES_MAX)), 1), HISTORY_CHANGES_MAX)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+
+    def build(version):
+        changes, synced, reset = history_store.changes_since(since, limit)
+        return jsonify({
+            'version': synced,
+            'changes': changes,
+            'reset': reset,
+            'has_more': synced < version
+        })
+
+    return _history_response(build)
+
+
+@app.route('/api/history/search', methods=['GET'])
+def search_history():
+    """全文检索历史记录（名称、补充说明、分析内容），按相关度排序
+
+    参数：q（关键词，空格分隔表示同时包含）、limit、offset
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '请输入检索关键词'}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_PAGE_SIZE)), 1), HISTORY_PAGE_MAX)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': '参数格式错误'}), 400
+
+    hits, next_offset = history_store.search(query, limit=limit, offset=offset)
+    return jsonify({'hits': hits, 'next_offset': next_offset})
+
+
+@app.route('/api/history/<record_id>', methods=['GET'])
+def get_history_record(record_id):
+    """获取单条完整历史记录（包括已归档的记录）
+
+    每条分析带渲染好的 html 字段；参数 html=0 时只返回 Markdown。
+    """
+    include_html = request.args.get('html', '1') != '0'
+
+    def build(version):
+        record = history_store.get(record_id) or retention.read_archived(record_id)
+        if record is None:
+            return jsonify({'error': '记录不存在'}), 404
+        if include_html:
+            analyses = [with_html(a) for a in record.get('analyses', [])]
+        else:
+            analyses = [{k: v for k, v in a.items() if k != 'html'} for a in record.get('analyses', [])]
+        return jsonify({'record': dict(record, analyses=analyses)})
+
+    return _history_response(build)
 
 
 @app.route('/api/history/<record_id>', methods=['DELETE'])
@@ -851,5 +1990,36 @@ def update_history_record_name(record_id):
 
 
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(debug=False, host='0.0.0.0', port=port)
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='趋势分析工具')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='以 gunicorn 启动生产服务（配置见 gunicorn.conf.py）')
+    serve_parser.add_argument('--bind', help='监听地址，默认 0.0.0.0:$PORT')
+    serve_parser.add_argument('--workers', type=int, help='worker 进程数，默认为 CPU 核数（至少 2）')
+    serve_parser.add_argument('--threads', type=int, help='每个 worker 的线程数，默认 16')
+    serve_parser.add_argument('--worker-class', help='worker 类型，默认 gthread')
+    retention_parser = subparsers.add_parser('retention', help='执行一次保留策略（归档、回收图片、整理存储）')
+    retention_parser.add_argument('--dry-run', action='store_true', help='只统计，不修改任何数据')
+    retention_parser.add_argument('--vacuum', action='store_true', help='整理后执行 VACUUM 回收磁盘空间')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        # 用 gunicorn 替换当前进程：各 worker 自行导入 app，
+        # 任务线程、写回线程等模块级状态不能跨 fork 继承
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        argv = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(base_dir, 'gunicorn.conf.py'),
+                '--pythonpath', base_dir]
+        for option in ('bind', 'workers', 'threads', 'worker_class'):
+            value = getattr(args, option)
+            if value is not None:
+                argv += ['--' + option.replace('_', '-'), str(value)]
+        argv.append('app:app')
+        sys.stdout.flush()
+        os.execv(sys.executable, argv)
+    elif args.command == 'retention':
+        print(json.dumps(retention.run(dry_run=args.dry_run, vacuum=args.vacuum), ensure_ascii=False))
+    else:
+        port = int(os.environ.get('PORT', 5000))
+        app.run(debug=False, host='0.0.0.0', port=port)
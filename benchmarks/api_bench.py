@@ -0,0 +1,303 @@
+"""API 基准测试与负载测试
+
+在进程内通过 Flask test client 压测（不经过网络），模型后端使用演示结果或本地
+mock_server.py，覆盖：
+- POST /api/analyze：不同图片数量、尺寸、风格数量
+- GET /api/history：1k / 10k / 100k 条历史记录时的首页和翻页
+- 并发重命名、删除历史记录
+
+每个场景输出吞吐、p50/p95/p99 延迟和进程峰值内存，结果可保存为基线，
+之后与基线对比，超出容忍度时以非零状态退出。
+
+用法：
+    python benchmarks/api_bench.py --save-baseline benchmarks/baseline.json
+    python benchmarks/api_bench.py --baseline benchmarks/baseline.json          # 与基线对比
+    python benchmarks/api_bench.py --quick --backend mock --only analyze        # 快速运行部分场景
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+ANALYSIS_TEXT = '# 技术指标分析报告\n\n- 响应时间：198ms\n- 峰值 QPS：9200\n' * 20
+STYLES = ['formal_tech', 'formal_business', 'daily_report', 'concise_tech', 'weekly_report']
+# 比较基线时参与判断的指标：吞吐越低越差，延迟越高越差
+COMPARED_METRICS = {'throughput': -1, 'p50_ms': 1, 'p95_ms': 1}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为 KB，macOS 为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_load(request_fn, total, concurrency):
+    """并发执行 total 次 request_fn(i)，返回统计结果；request_fn 返回 HTTP 状态码"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        status = request_fn(i)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput': round(total / wall, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def make_images(count, size, seed):
+    """生成内容各不相同的 PNG（避免命中去重和结果缓存）"""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        img = Image.new('RGB', size, (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        # 折线：让图片内容接近真实的趋势图，同时保证每张不同
+        pixels = img.load()
+        y = size[1] // 2
+        for x in range(size[0]):
+            y = max(0, min(size[1] - 1, y + rng.randint(-2, 2)))
+            pixels[x, y] = (0, 0, 0)
+        buf = io.BytesIO()
+        img.save(buf, 'PNG')
+        images.append(buf.getvalue())
+    return images
+
+
+def bench_analyze(app_module, quick):
+    client = app_module.app.test_client()
+    requests = 10 if quick else 40
+    concurrency = 4
+    sizes = {'small': (640, 360), 'large': (2560, 1440)}
+    results = {}
+    for image_count in (1, 3):
+        for size_name, size in sizes.items():
+            for style_count in (1, 3):
+                name = f'analyze_img{image_count}_{size_name}_styles{style_count}'
+                payloads = [make_images(image_count, size, seed=f'{name}-{i}') for i in range(requests)]
+
+                def request_fn(i):
+                    data = {
+                        'images': [(io.BytesIO(raw), f'{n}.png') for n, raw in enumerate(payloads[i])],
+                        'styles': STYLES[:style_count],
+                        'no_cache': '1'
+                    }
+                    return client.post('/api/analyze', data=data, content_type='multipart/form-data').status_code
+
+                results[name] = run_load(request_fn, requests, concurrency)
+                print_result(name, results[name])
+    return results
+
+
+def make_record(index, base_time):
+    from history_store import new_record_id
+
+    return {
+        'id': new_record_id(),
+        'timestamp': (base_time + timedelta(seconds=index)).isoformat(),
+        'name': f'bench_{index}',
+        'images': [f'uploads/bench_{index % 500}.png'],
+        'user_context': '',
+        'analyses': [{'success': True, 'style': '正式-技术视角', 'analysis': ANALYSIS_TEXT}]
+    }
+
+
+def seed_history(app_module, workdir, count):
+    """为指定记录数准备独立的历史数据库，并替换应用使用的存储"""
+    from history_store import HistoryStore
+
+    store = HistoryStore(os.path.join(workdir, f'history_{count}.db'))
+    base_time = datetime.now() - timedelta(seconds=count)
+    for start in range(0, count, 1000):
+        store.insert_many([make_record(i, base_time) for i in range(start, min(count, start + 1000))])
+    app_module.history_store = store
+    return store
+
+
+def bench_history(app_module, workdir, sizes, quick):
+    client = app_module.app.test_client()
+    requests = 50 if quick else 200
+    results = {}
+    for count in sizes:
+        seeded = time.perf_counter()
+        seed_history(app_module, workdir, count)
+        print(f'  已准备 {count} 条记录（{time.perf_counter() - seeded:.1f}s）')
+
+        name = f'history_first_page_{count}'
+        results[name] = run_load(lambda i: client.get('/api/history').status_code, requests, 4)
+        print_result(name, results[name])
+
+        # 翻到中间位置附近的一页
+        cursor = json.loads(client.get(f'/api/history?limit={min(200, count // 2)}').data)['next_cursor']
+        name = f'history_next_page_{count}'
+        results[name] = run_load(
+            lambda i: client.get(f'/api/history?cursor={cursor}').status_code, requests, 4
+        )
+        print_result(name, results[name])
+    return results
+
+
+def bench_mutations(app_module, workdir, quick):
+    client = app_module.app.test_client()
+    count = 1000 if quick else 5000
+    store = seed_history(app_module, workdir, count)
+    ids = [summary['id'] for summary in store.list_summaries(limit=count)[0]]
+    operations = len(ids) // 2
+    concurrency = 8
+    results = {}
+
+    name = 'history_rename_concurrent'
+    results[name] = run_load(
+        lambda i: client.put(f'/api/history/{ids[i]}/name', json={'name': f'renamed_{i}'}).status_code,
+        operations, concurrency
+    )
+    print_result(name, results[name])
+
+    name = 'history_delete_concurrent'
+    results[name] = run_load(
+        lambda i: client.delete(f'/api/history/{ids[operations + i]}').status_code,
+        operations, concurrency
+    )
+    print_result(name, results[name])
+    return results
+
+
+def print_result(name, result):
+    print(
+        f"{name:<42} {result['throughput']:>9.1f} req/s  p50 {result['p50_ms']:>8.1f}ms  "
+        f"p95 {result['p95_ms']:>8.1f}ms  p99 {result['p99_ms']:>8.1f}ms  "
+        f"错误 {result['errors']:>3}  峰值内存 {result['peak_rss_mb']}MB"
+    )
+
+
+def compare(results, baseline, tolerance):
+    """与基线对比，返回退化的场景列表"""
+    regressions = []
+    print(f'\n与基线对比（容忍度 {tolerance:.0%}）：')
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<42} 基线中没有该场景')
+            continue
+        changes = []
+        for metric, direction in COMPARED_METRICS.items():
+            if not base[metric]:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            flag = ''
+            if change * direction > tolerance:
+                flag = ' ✗'
+                regressions.append(f'{name}.{metric}')
+            changes.append(f'{metric} {change:+.1%}{flag}')
+        print(f"{name:<42} {'  '.join(changes)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API 基准测试')
+    parser.add_argument('--backend', choices=['demo', 'mock'], default='demo',
+                        help='demo 使用预设结果，mock 通过 HTTP 调用本地 mock_server')
+    parser.add_argument('--mock-latency', type=float, default=0.05, help='mock 后端每次调用的延迟（秒）')
+    parser.add_argument('--only', choices=['analyze', 'history', 'mutations'], action='append',
+                        help='只运行指定场景组（可重复）')
+    parser.add_argument('--history-sizes', default='1000,10000,100000', help='历史记录数量，逗号分隔')
+    parser.add_argument('--quick', action='store_true', help='减少请求数，快速检查')
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--save-baseline', help='把结果保存为基线')
+    parser.add_argument('--baseline', help='与基线文件对比')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允许的退化比例')
+    args = parser.parse_args()
+
+    # 在临时目录中运行，不影响项目的 uploads/ 和 data/
+    output_paths = [os.path.abspath(p) for p in (args.output, args.save_baseline) if p]
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix='api_bench_')
+    os.chdir(workdir)
+    os.environ.setdefault('RESULT_CACHE_BACKEND', 'memory')
+    os.environ.setdefault('MODEL_RATE_LIMIT', '0')
+    if args.backend == 'mock':
+        from mock_server import make_server
+
+        server = make_server(port=0, latency=args.mock_latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ['CLAUDE_API_KEY'] = 'bench'
+        os.environ['CLAUDE_API_URL'] = f'http://127.0.0.1:{server.server_address[1]}'
+    else:
+        os.environ.pop('CLAUDE_API_KEY', None)
+
+    import app as app_module
+
+    groups = args.only or ['analyze', 'history', 'mutations']
+    print(f'工作目录: {workdir}，后端: {args.backend}')
+    results = {}
+    if 'analyze' in groups:
+        results.update(bench_analyze(app_module, args.quick))
+    if 'history' in groups:
+        sizes = [int(size) for size in args.history_sizes.split(',') if size]
+        results.update(bench_history(app_module, workdir, sizes, args.quick))
+    if 'mutations' in groups:
+        results.update(bench_mutations(app_module, workdir, args.quick))
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'backend': args.backend,
+        'quick': args.quick,
+        'results': results
+    }
+    for path in output_paths:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'结果已保存到 {path}')
+
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('性能退化: ' + ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""本地趋势图数据提取的基准测试
+
+生成一组已知数据的合成趋势图（单/多系列折线、柱状图、带网格线与图例、不同尺寸、
+含异常点），逐张提取并与真实数据对比，输出：
+- 每张图的提取耗时（p50 / p95 / 最大）
+- 识别率、图表类型正确率
+- 数值平均绝对误差（相对绘图区高度）、趋势方向正确率
+
+也可用 --dir 对一个目录中的真实截图只统计耗时和识别率。
+
+用法：
+    python benchmarks/chart_extract_bench.py
+    python benchmarks/chart_extract_bench.py --count 50 --save-fixtures /tmp/charts
+    python benchmarks/chart_extract_bench.py --dir path/to/screenshots
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+from chart_extract import SAMPLE_POINTS, extract, trend_stats  # noqa: E402
+
+
+PALETTE = [(31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189)]
+SIZES = [(640, 360), (1280, 720), (1920, 1080)]
+
+
+def make_values(rng, points):
+    """随机趋势 + 噪声，偶尔加入一个尖峰"""
+    trend = rng.uniform(-0.5, 0.5)
+    start = rng.uniform(0.25, 0.75) - trend / 2
+    values = [start + trend * i / (points - 1) + rng.gauss(0, 0.02) for i in range(points)]
+    if rng.random() < 0.3:
+        values[rng.randrange(2, points - 2)] += rng.choice([-1, 1]) * 0.2
+    return [min(0.95, max(0.05, v)) for v in values]
+
+
+def draw_frame(draw, size, rng):
+    """坐标轴、网格线、标题与图例区域，返回绘图区 (x0, y0, x1, y1)"""
+    width, height = size
+    x0, y0 = int(width * 0.1), int(height * 0.15)
+    x1, y1 = int(width * 0.95), int(height * 0.85)
+    for i in range(5):
+        y = y0 + (y1 - y0) * i // 4
+        draw.line([(x0, y), (x1, y)], fill=(220, 220, 220) if i < 4 else (60, 60, 60), width=1)
+    draw.line([(x0, y0), (x0, y1)], fill=(60, 60, 60), width=1)
+    draw.text((x0, int(height * 0.03)), 'Daily active users', fill=(40, 40, 40))
+    for i in range(5):
+        draw.text((x0 - 30, y1 - (y1 - y0) * i // 4 - 5), str(i * 25), fill=(90, 90, 90))
+    return x0, y0, x1, y1
+
+
+def make_chart(kind, series_count, size, rng):
+    """生成一张图，返回 (图片, 真实数据列表)"""
+    img = Image.new('RGB', size, (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    x0, y0, x1, y1 = draw_frame(draw, size, rng)
+    scale = max(1, size[0] // 640)
+    truth = []
+
+    if kind == 'line':
+        points = rng.randint(12, 40)
+        pad = (x1 - x0) // 40
+        for s in range(series_count):
+            values = make_values(rng, points)
+            xs = [x0 + pad + (x1 - x0 - 2 * pad) * i / (points - 1) for i in range(points)]
+            ys = [y1 - v * (y1 - y0) for v in values]
+            draw.line(list(zip(xs, ys)), fill=PALETTE[s], width=2 * scale, joint='curve')
+            # 以采样点为准的真实曲线
+            grid = np.linspace(xs[0], xs[-1], SAMPLE_POINTS)
+            truth.append(np.interp(grid, xs, values))
+    else:
+        bars = rng.randint(5, 14)
+        slot = (x1 - x0) / bars
+        for s in range(series_count):
+            values = make_values(rng, bars)
+            bar_width = slot * 0.7 / series_count
+            for i, v in enumerate(values):
+                left = x0 + slot * i + slot * 0.15 + bar_width * s
+                draw.rectangle([left, y1 - v * (y1 - y0), left + bar_width - 1, y1 - 1], fill=PALETTE[s])
+            truth.append(np.array(values))
+
+    # 图例放在绘图区上方
+    for s in range(series_count):
+        lx = x0 + s * 90 * scale
+        draw.rectangle([lx, y0 - 20 * scale, lx + 12 * scale, y0 - 12 * scale], fill=PALETTE[s])
+        draw.text((lx + 16 * scale, y0 - 22 * scale), f'series {s + 1}', fill=(40, 40, 40))
+    return img, truth
+
+
+def build_fixtures(folder, count, seed):
+    rng = random.Random(seed)
+    fixtures = []
+    for i in range(count):
+        kind = 'line' if i % 2 == 0 else 'bar'
+        series_count = 1 + (i // 2) % 3
+        size = SIZES[(i // 6) % len(SIZES)]
+        img, truth = make_chart(kind, series_count, size, rng)
+        path = os.path.join(folder, f'chart_{i:03d}_{kind}{series_count}_{size[0]}.png')
+        img.save(path)
+        fixtures.append({'path': path, 'kind': kind, 'truth': truth})
+    return fixtures
+
+
+def match_series(extracted, truth):
+    """按颜色顺序无关的方式，把每条真实序列与误差最小的提取序列配对，返回各自的平均绝对误差"""
+    errors = []
+    for expected in truth:
+        best = None
+        for series in extracted:
+            values = np.array(series['values'])
+            if len(values) != len(expected):
+                continue
+            error = float(np.abs(values - expected).mean())
+            best = error if best is None else min(best, error)
+        errors.append(best)
+    return errors
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(fixtures, repeat):
+    timings = []
+    detected = kind_ok = direction_ok = direction_total = 0
+    errors = []
+    for fixture in fixtures:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = extract(fixture['path'])
+            timings.append((time.perf_counter() - started) * 1000)
+        if result is None:
+            continue
+        detected += 1
+        truth = fixture.get('truth')
+        if truth is None:
+            continue
+        kind_ok += all(series['type'] == fixture['kind'] for series in result['series'])
+        for expected, error in zip(truth, match_series(result['series'], truth)):
+            direction_total += 1
+            if error is None:
+                continue
+            errors.append(error)
+            matched = min(
+                (s for s in result['series'] if len(s['values']) == len(expected)),
+                key=lambda s: np.abs(np.array(s['values']) - expected).mean()
+            )
+            direction_ok += matched['stats']['direction'] == trend_stats(expected)['direction']
+
+    total = len(fixtures)
+    print(f'图表数 {total}，每张重复 {repeat} 次')
+    print(f'提取耗时  p50 {percentile(timings, 50):.1f}ms  p95 {percentile(timings, 95):.1f}ms  '
+          f'最大 {max(timings):.1f}ms')
+    print(f'识别率    {detected / total:.0%}')
+    if any(f.get('truth') is not None for f in fixtures):
+        print(f'类型正确  {kind_ok / total:.0%}')
+        if errors:
+            print(f'数值误差  平均 {np.mean(errors):.3f}  p95 {percentile(errors, 95):.3f}（相对绘图区高度），'
+                  f'配对成功 {len(errors)}/{direction_total} 条序列')
+        if direction_total:
+            print(f'趋势方向  {direction_ok / direction_total:.0%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地趋势图数据提取基准测试')
+    parser.add_argument('--count', type=int, default=36, help='合成图表数量')
+    parser.add_argument('--seed', type=int, default=7, help='随机种子（相同种子生成相同的图表）')
+    parser.add_argument('--repeat', type=int, default=3, help='每张图重复提取的次数')
+    parser.add_argument('--save-fixtures', help='把合成图表保存到该目录')
+    parser.add_argument('--dir', help='改为测试该目录中的图片（只统计耗时与识别率）')
+    args = parser.parse_args()
+
+    if args.dir:
+        names = sorted(n for n in os.listdir(args.dir) if n.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))
+        fixtures = [{'path': os.path.join(args.dir, n)} for n in names]
+    else:
+        folder = args.save_fixtures or tempfile.mkdtemp(prefix='chart_fixtures_')
+        os.makedirs(folder, exist_ok=True)
+        fixtures = build_fixtures(folder, args.count, args.seed)
+        print(f'合成图表目录: {folder}')
+    if not fixtures:
+        print('没有可测试的图片')
+        return 1
+    run(fixtures, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""历史记录并发写入压力测试
+
+N 个进程同时写入历史记录（插入为主，夹杂重命名），结束后检查：
+- 记录总数是否等于写入总数（没有丢失写入）
+- 所有记录 id 是否唯一
+- 重命名是否全部生效
+
+用法：
+    python benchmarks/history_stress.py --writers 8 --records 200
+    python benchmarks/history_stress.py --writers 8 --records 200 --legacy   # 对比旧版 history.json 写法
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import HistoryStore, new_record_id  # noqa: E402
+
+
+ANALYSIS_TEXT = '# 技术指标分析报告\n\n- 响应时间：198ms\n- 峰值 QPS：9200\n' * 20
+
+
+def make_record(worker, index):
+    return {
+        'id': new_record_id(),
+        'timestamp': datetime.now().isoformat(),
+        'name': f'worker{worker}_{index}',
+        'images': [f'uploads/{worker}_{index}.png'],
+        'user_context': '',
+        'analyses': [{'success': True, 'style': '正式-技术视角', 'analysis': ANALYSIS_TEXT}]
+    }
+
+
+def store_writer(db_path, worker, records, start_event):
+    store = HistoryStore(db_path)
+    start_event.wait()
+    for index in range(records):
+        record_id = store.insert(make_record(worker, index))
+        if index % 10 == 0:
+            store.rename(record_id, f'renamed_{worker}_{index}')
+
+
+def legacy_writer(json_path, worker, records, start_event):
+    """旧版实现：每次读取整个 history.json，修改后整体写回（无锁）"""
+    start_event.wait()
+    for index in range(records):
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # 其它进程写到一半时读到的是不完整的文件
+            history = []
+        record = make_record(worker, index)
+        history.insert(0, record)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
+
+
+def run(writers, records, legacy):
+    workdir = tempfile.mkdtemp(prefix='history_stress_')
+    path = os.path.join(workdir, 'history.json' if legacy else 'history.db')
+    if not legacy:
+        HistoryStore(path)  # 预先建表
+
+    start_event = multiprocessing.Event()
+    target = legacy_writer if legacy else store_writer
+    processes = [
+        multiprocessing.Process(target=target, args=(path, worker, records, start_event))
+        for worker in range(writers)
+    ]
+    for process in processes:
+        process.start()
+
+    started = time.perf_counter()
+    start_event.set()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    expected = writers * records
+    if legacy:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except ValueError:
+            history = []
+        stored = len(history)
+        unique_ids = len({h['id'] for h in history})
+        renamed_ok = True
+    else:
+        store = HistoryStore(path)
+        history, cursor = store.list_summaries(limit=1000)
+        while cursor is not None:
+            page, cursor = store.list_summaries(limit=1000, cursor=cursor)
+            history.extend(page)
+        stored = len(history)
+        unique_ids = len({h['id'] for h in history})
+        renamed = sum(1 for h in history if h['name'].startswith('renamed_'))
+        renamed_ok = renamed == writers * len(range(0, records, 10))
+
+    print(f"模式: {'旧版 history.json' if legacy else 'SQLite 历史存储'}")
+    print(f'写入进程: {writers}，每进程记录数: {records}')
+    print(f'耗时: {elapsed:.2f}s，吞吐: {expected / elapsed:.0f} 条/秒')
+    print(f'期望记录数: {expected}，实际记录数: {stored}，丢失: {expected - stored}')
+    print(f'唯一 id 数: {unique_ids}')
+    if not legacy:
+        print(f"重命名全部生效: {'是' if renamed_ok else '否'}")
+
+    ok = stored == expected and unique_ids == expected and renamed_ok
+    print('结果: ' + ('通过' if ok else '失败'))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='历史记录并发写入压力测试')
+    parser.add_argument('--writers', type=int, default=8, help='并发写入进程数')
+    parser.add_argument('--records', type=int, default=200, help='每个进程写入的记录数')
+    parser.add_argument('--legacy', action='store_true', help='使用旧版整文件读写方式对比')
+    args = parser.parse_args()
+    sys.exit(0 if run(args.writers, args.records, args.legacy) else 1)
@@ -0,0 +1,164 @@
+"""生产服务并发能力对比：sync worker 与 gthread worker
+
+启动本地 mock_server.py（每次模型调用固定延迟）作为模型后端，分别以
+- sync：gunicorn 默认同步 worker（旧 Procfile 的方式，每个请求占住整个进程）
+- gthread：python -m app serve 使用的 gunicorn.conf.py 配置
+启动服务，通过 HTTP 并发发送 /api/analyze 请求，对比吞吐与延迟。
+
+用法：
+    python benchmarks/server_concurrency.py --requests 64 --concurrency 32 --latency 1.0
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_server import make_server  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_png(index):
+    """每个请求一张不同的图片，避免结果缓存和请求合并"""
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 64), (index % 256, index // 256 % 256, 128)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def multipart_body(image, styles):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for style in styles:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="styles"\r\n\r\n{style}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="images"; filename="chart.png"\r\n'
+        f'Content-Type: image/png\r\n\r\n'.encode() + image + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url + '/api/styles', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('服务启动超时')
+
+
+def start_server(mode, port, env, workdir, workers, threads):
+    if mode == 'sync':
+        cmd = [sys.executable, '-m', 'gunicorn', '--pythonpath', ROOT, '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--timeout', '300', 'app:app']
+    else:
+        cmd = [sys.executable, os.path.join(ROOT, 'app.py'), 'serve', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--threads', str(threads)]
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_load(url, total, concurrency, styles, offset):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        body, content_type = multipart_body(make_png(offset + i), styles)
+        req = urllib.request.Request(url + '/api/analyze', data=body, headers={'Content-Type': content_type})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=300) as resp:
+                ok = json.loads(resp.read()).get('success')
+        except OSError:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'throughput': total / wall,
+        'p50': latencies[len(latencies) // 2],
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'errors': errors,
+        'wall': wall
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sync 与 gthread worker 并发能力对比')
+    parser.add_argument('--requests', type=int, default=64, help='每种模式的请求总数')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发客户端数')
+    parser.add_argument('--latency', type=float, default=1.0, help='模拟模型调用延迟（秒）')
+    parser.add_argument('--styles', type=int, default=1, help='每个请求的分析风格数')
+    parser.add_argument('--workers', type=int, default=2, help='两种模式使用相同的 worker 进程数')
+    parser.add_argument('--threads', type=int, default=16, help='gthread 每个 worker 的线程数')
+    args = parser.parse_args()
+
+    mock = make_server(port=0, latency=args.latency)
+    threading.Thread(target=mock.serve_forever, daemon=True).start()
+    styles = ['formal_tech', 'formal_business', 'daily_report', 'concise_tech'][:args.styles]
+
+    env = dict(
+        os.environ,
+        CLAUDE_API_KEY='bench',
+        CLAUDE_API_URL=f'http://127.0.0.1:{mock.server_address[1]}',
+        MODEL_RATE_LIMIT='0',
+        RESULT_CACHE_BACKEND='off',
+        IMAGE_PREPROCESS='0',
+        PYTHONPATH=ROOT
+    )
+
+    print(f'模型延迟 {args.latency}s，{args.requests} 个请求，{args.concurrency} 并发，'
+          f'{args.workers} 个 worker，每请求 {len(styles)} 个风格')
+    results = {}
+    for index, mode in enumerate(('sync', 'gthread')):
+        workdir = tempfile.mkdtemp(prefix=f'server_bench_{mode}_')
+        port = free_port()
+        server = start_server(mode, port, env, workdir, args.workers, args.threads)
+        try:
+            url = f'http://127.0.0.1:{port}'
+            wait_until_ready(url)
+            results[mode] = run_load(url, args.requests, args.concurrency, styles, offset=index * args.requests)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        r = results[mode]
+        print(f"{mode:<8} {r['throughput']:>7.2f} req/s  p50 {r['p50']:.2f}s  p95 {r['p95']:.2f}s  "
+              f"总耗时 {r['wall']:.1f}s  失败 {r['errors']}")
+
+    print(f"gthread 吞吐为 sync 的 {results['gthread']['throughput'] / results['sync']['throughput']:.1f} 倍")
+
+
+if __name__ == '__main__':
+    main()
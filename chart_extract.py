@@ -0,0 +1,330 @@
+"""趋势图数据提取 - 在本地把简单的折线图、柱状图还原为数值序列
+
+流程：
+1. 以出现最多的颜色为背景，用贯穿大部分宽度/高度的灰色线条定位坐标轴，确定绘图区
+2. 绘图区内饱和度较高的颜色按出现次数聚类，得到各个系列的颜色
+3. 折线按列取该颜色像素的平均高度并插值到固定的采样点；
+   柱状图按连续的列分组，每组取柱顶高度
+4. 用 NumPy 计算趋势统计：斜率、首尾变化、移动平均、峰值/谷值和异常点
+
+没有识别坐标轴刻度文字，数值为相对绘图区高度的比例（0~1）；纵轴不从 0 开始时，
+百分比变化只反映图上的相对变化。需要 Pillow 和 NumPy，未安装时不提取。
+"""
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # pragma: no cover - 缺少依赖时跳过本地提取
+    np = None
+    Image = None
+
+
+# 提取前把图片缩放到的最长边（像素），兼顾速度与细线条的保留
+MAX_EDGE = 1000
+# 折线的采样点数
+SAMPLE_POINTS = 32
+# 最多识别的系列数
+MAX_SERIES = 5
+# 判断“有颜色”的饱和度阈值（通道最大值减最小值）
+SATURATION = 50
+# 与背景色差（三通道差的绝对值之和）超过该值视为前景
+INK_DISTANCE = 60
+# 坐标轴、网格线的色差阈值（浅色网格线缩小后颜色更淡，阈值更低）
+LINE_DISTANCE = 24
+# 属于同一系列的颜色距离
+COLOR_DISTANCE = 80
+
+
+def _load(path, max_edge):
+    """读取为 (3, 高, 宽) 的 int16 数组：按通道分开存放，逐像素的通道运算都是连续内存上的向量运算"""
+    with Image.open(path) as img:
+        img.draft('RGB', (max_edge, max_edge))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        factor = -(-max(img.size) // max_edge)
+        if factor > 1:
+            # 整数倍的区域平均缩小，比任意比例的重采样快得多
+            img = img.reduce(factor)
+        return np.ascontiguousarray(np.asarray(img).transpose(2, 0, 1), dtype=np.int16)
+
+
+def _quantize(planes, bits=4):
+    # 每通道取高 bits 位，得到颜色编号
+    shift = 8 - bits
+    return ((planes[0] >> shift) << (2 * bits)) | ((planes[1] >> shift) << bits) | (planes[2] >> shift)
+
+
+def _distance(planes, color):
+    # 颜色取整后保持 int16 运算，避免整幅图提升为 float64
+    color = [int(round(c)) for c in color]
+    return np.abs(planes[0] - color[0]) + np.abs(planes[1] - color[1]) + np.abs(planes[2] - color[2])
+
+
+def _hue(color):
+    """颜色去掉明暗和饱和度后的方向，用于识别抗锯齿产生的混合色"""
+    low = color.min()
+    return (color - low) / max(color.max() - low, 1)
+
+
+def _plot_area(gray_lines, colored):
+    """坐标轴和网格线围成的绘图区 (top, bottom, left, right)，bottom 为基线所在行"""
+    height, width = gray_lines.shape
+    rows = np.flatnonzero(gray_lines.sum(axis=1) > width * 0.5)
+    cols = np.flatnonzero(gray_lines.sum(axis=0) > height * 0.5)
+    ys, xs = np.nonzero(colored)
+    if len(ys) == 0:
+        return None
+
+    bottom = rows.max() if len(rows) else ys.max()
+    top = rows.min() if len(rows) > 1 else ys.min()
+    # 纵轴在所有数据的左侧；右边界取数据的范围（柱子边缘的混合色也可能形成竖直的灰线）
+    axes = cols[cols < xs.min()]
+    left = axes.max() + 1 if len(axes) else xs.min()
+    right = xs.max()
+    if bottom - top < 10 or right - left < 10:
+        return None
+    return int(top), int(bottom), int(left), int(right)
+
+
+def _series_colors(planes, colored):
+    """按出现次数选出系列颜色；相近的颜色、以及与已选颜色色相相同的混合色不作为新系列"""
+    candidates = planes[:, colored]
+    # 聚类用较粗的量化（每通道 3 位），有损压缩造成的色偏仍落在同一区间
+    codes = _quantize(candidates, bits=3)
+    counts = np.bincount(codes, minlength=512)
+    # 每个系列至少占彩色像素的 4%，少量抗锯齿、压缩噪声不会成为系列
+    min_count = max(20, int(candidates.shape[1] * 0.04))
+    colors = []
+    for code in np.argsort(counts)[::-1]:
+        if counts[code] < min_count or len(colors) >= MAX_SERIES:
+            break
+        color = candidates[:, codes == code].mean(axis=1)
+        if all(np.abs(color - c).sum() > COLOR_DISTANCE and np.abs(_hue(color) - _hue(c)).sum() > 0.3
+               for c in colors) and not _is_mixture(color, colors):
+            colors.append(color)
+    return colors
+
+
+def _is_mixture(color, colors):
+    """相邻两个系列交界处缩小后产生的混合色：位于两个已选颜色的连线附近"""
+    for i, a in enumerate(colors):
+        for b in colors[i + 1:]:
+            direction = a - b
+            t = np.clip(np.dot(color - b, direction) / max(np.dot(direction, direction), 1), 0, 1)
+            if np.abs(color - (b + t * direction)).sum() < COLOR_DISTANCE / 2:
+                return True
+    return False
+
+
+def _line_values(mask, points):
+    height = mask.shape[0]
+    counts = mask.sum(axis=0)
+    has = counts > 0
+    xs = np.flatnonzero(has)
+    rows = np.arange(height)[:, None]
+    mean_row = (mask * rows).sum(axis=0)[has] / counts[has]
+    values = (height - 1 - mean_row) / (height - 1)
+    grid = np.linspace(xs[0], xs[-1], points)
+    return np.interp(grid, xs, values)
+
+
+def _bar_values(mask, top):
+    height = mask.shape[0]
+    has = mask.any(axis=0)
+    edges = np.diff(np.concatenate(([0], has.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= 2
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return None
+    # 每根柱子取最高点（不属于柱子的列置为基线，不影响最小值）
+    tops = np.minimum.reduceat(np.where(has, top, height - 1), starts)
+    return (height - 1 - tops) / (height - 1)
+
+
+def _extract_series(region, colored, color):
+    height, width = colored.shape
+    mask = colored & (_distance(region, color) < COLOR_DISTANCE)
+    counts = mask.sum(axis=0)
+    has = counts > 0
+    if has.sum() < 5:
+        return None
+
+    top = np.argmax(mask, axis=0)
+    bottom = height - 1 - np.argmax(mask[::-1], axis=0)
+    span = (bottom - top + 1)[has]
+    fill = counts[has] / span
+    # 柱子：各列从顶部到基线几乎填满；占满整个宽度的单个色块视为面积图，按折线处理
+    is_bar = (
+        np.median(fill) > 0.85
+        and np.median(span) > height * 0.08
+        and np.median(bottom[has]) >= height - 1 - max(3, height * 0.03)
+    )
+    if is_bar:
+        values = _bar_values(mask, top)
+        if values is not None and (len(values) > 1 or has.sum() < width * 0.5):
+            return 'bar', values
+    return 'line', _line_values(mask, SAMPLE_POINTS)
+
+
+def extract(path, max_edge=MAX_EDGE):
+    """提取图片中的数据序列；不像趋势图或无法识别时返回 None"""
+    if np is None:
+        return None
+    try:
+        planes = _load(path, max_edge)
+    except (OSError, Image.DecompressionBombError):
+        return None
+    try:
+        return _extract_planes(planes)
+    except (ValueError, IndexError):
+        # 不符合趋势图假设的图片（如照片、纯文字截图）可能得到退化的区域或序列
+        return None
+
+
+def _extract_planes(planes):
+    # 背景色：出现最多的颜色（隔行隔列抽样统计即可）
+    sample = planes[:, ::4, ::4]
+    codes = _quantize(sample)
+    background = sample[:, codes == np.argmax(np.bincount(codes.ravel(), minlength=4096))].mean(axis=1)
+    distance = _distance(planes, background)
+    saturation = np.maximum(np.maximum(planes[0], planes[1]), planes[2]) - \
+        np.minimum(np.minimum(planes[0], planes[1]), planes[2])
+    gray = saturation <= SATURATION
+    colored = (distance > INK_DISTANCE) & ~gray
+    area = _plot_area((distance > LINE_DISTANCE) & gray, colored)
+    if area is None:
+        return None
+
+    # 只在绘图区内找系列：基线之下、坐标轴之外的彩色像素多为图例或标题
+    top, bottom, left, right = area
+    region = planes[:, top:bottom + 1, left:right + 1]
+    region_colored = colored[top:bottom + 1, left:right + 1]
+    series = []
+    for color in _series_colors(region, region_colored):
+        found = _extract_series(region, region_colored, color)
+        if found is None:
+            continue
+        kind, values = found
+        # 有损压缩在线条周围留下的色晕会被识别为位置完全重合的另一系列
+        if any(other['type'] == kind and len(other['values']) == len(values)
+               and np.abs(np.array(other['values']) - values).mean() < 0.02 for other in series):
+            continue
+        r, g, b = (int(round(c)) for c in color)
+        series.append({
+            'type': kind,
+            'color': f'#{r:02x}{g:02x}{b:02x}',
+            'values': [round(float(v), 4) for v in values],
+            'stats': trend_stats(values)
+        })
+    if not series:
+        return None
+    return {'plot_area': [left, top, right, bottom], 'size': [planes.shape[2], planes.shape[1]], 'series': series}
+
+
+def trend_stats(values, flat_threshold=0.05):
+    """序列的趋势统计；flat_threshold 为判定为“平稳”的首尾拟合变化量（相对绘图区高度）"""
+    v = np.asarray(values, dtype=float)
+    n = len(v)
+    stats = {'points': n, 'start': round(float(v[0]), 4), 'end': round(float(v[-1]), 4),
+             'min': round(float(v.min()), 4), 'max': round(float(v.max()), 4), 'mean': round(float(v.mean()), 4)}
+    if n < 2:
+        return dict(stats, slope=0.0, r2=1.0, direction='flat', percent_change=None,
+                    moving_average={'window': 1, 'values': [stats['start']]},
+                    peak=0, trough=0, anomalies=[])
+
+    x = np.arange(n)
+    slope, intercept = np.polyfit(x, v, 1)
+    fitted = slope * x + intercept
+    total = float(slope * (n - 1))
+    direction = 'flat' if abs(total) < flat_threshold else ('up' if total > 0 else 'down')
+
+    window = max(2, min(5, n // 4))
+    moving_average = np.convolve(v, np.ones(window) / window, mode='valid')
+
+    # 异常点：偏离滚动中位数超过 3 倍 MAD（至少为绘图区高度的 5%）
+    k = min(5, n) | 1
+    padded = np.pad(v, k // 2, mode='edge')
+    rolling_median = np.median(np.lib.stride_tricks.sliding_window_view(padded, k), axis=1)
+    residual = v - rolling_median
+    mad = np.median(np.abs(residual)) * 1.4826
+    anomalies = np.flatnonzero(np.abs(residual) > max(3 * mad, 0.05))
+
+    ss_tot = float(((v - v.mean()) ** 2).sum())
+    return dict(
+        stats,
+        slope=round(float(slope), 5),
+        r2=round(1 - float(((v - fitted) ** 2).sum()) / ss_tot, 4) if ss_tot > 0 else 1.0,
+        direction=direction,
+        percent_change=round((v[-1] - v[0]) / abs(v[0]) * 100, 2) if abs(v[0]) > 0.02 else None,
+        moving_average={'window': window, 'values': [round(float(m), 4) for m in moving_average]},
+        peak=int(v.argmax()),
+        trough=int(v.argmin()),
+        anomalies=[int(i) for i in anomalies]
+    )
+
+
+DIRECTIONS = {'up': '整体上升', 'down': '整体下降', 'flat': '整体平稳'}
+KINDS = {'line': '折线', 'bar': '柱状'}
+
+
+def describe(charts, style_name):
+    """根据提取结果生成简洁的 Markdown 摘要（不调用模型）"""
+    lines = [f'# {style_name}（本地数据提取）', '']
+    for index, chart in enumerate(charts, 1):
+        lines.append(f'## 图 {index}')
+        for number, series in enumerate(chart['series'], 1):
+            s = series['stats']
+            change = f"，首尾变化 {s['percent_change']:+.1f}%" if s.get('percent_change') is not None else ''
+            summary = (f"- **系列 {number}**（{KINDS[series['type']]}，{series['color']}）："
+                       f"{DIRECTIONS[s['direction']]}{change}，最高点为第 {s['peak'] + 1}/{s['points']} 个点，"
+                       f"最低点为第 {s['trough'] + 1} 个点")
+            if s.get('anomalies'):
+                summary += f"，异常点 {len(s['anomalies'])} 个（第 {'、'.join(str(i + 1) for i in s['anomalies'])} 个点）"
+            lines.append(summary)
+        lines.append('')
+    lines.append('> 数值按绘图区高度换算，未识别坐标轴刻度；纵轴不从 0 开始时百分比仅反映图上的相对变化。')
+    return '\n'.join(lines)
+
+
+class ChartExtractor:
+    """按图片内容哈希缓存提取结果（LRU）；同一张图的多个风格并发请求时只提取一次"""
+
+    def __init__(self, max_entries=256, max_edge=MAX_EDGE):
+        self.max_entries = max_entries
+        self.max_edge = max_edge
+        self.enabled = np is not None
+        self._items = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def extract(self, path, digest):
+        with self._lock:
+            if digest in self._items:
+                self._items.move_to_end(digest)
+                return self._items[digest]
+            event = self._inflight.get(digest)
+            leader = event is None
+            if leader:
+                event = self._inflight[digest] = threading.Event()
+        if not leader:
+            event.wait()
+            with self._lock:
+                if digest in self._items:
+                    return self._items[digest]
+            return extract(path, self.max_edge)
+
+        try:
+            result = extract(path, self.max_edge)
+            with self._lock:
+                self._items[digest] = result
+                while len(self._items) > self.max_entries:
+                    self._items.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._inflight[digest]
+            event.set()
+        return result
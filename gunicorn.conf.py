@@ -0,0 +1,48 @@
+"""gunicorn 生产配置（python -m app serve 或 gunicorn -c gunicorn.conf.py app:app）
+
+分析请求的大部分时间在等待模型接口，属于 I/O 密集型：默认使用 gthread worker，
+每个 worker 进程内多个线程并发处理请求，等待模型时不会占住整个进程。
+缓存、连接池、限流都按进程共享，因此进程数取 CPU 核数（至少 2），并发主要靠线程数。
+
+可用环境变量覆盖：
+- WEB_CONCURRENCY：worker 进程数
+- GUNICORN_THREADS：每个 worker 的线程数
+- GUNICORN_WORKER_CLASS：worker 类型（如已安装 gevent 可设为 gevent）
+- GUNICORN_TIMEOUT：请求超时（秒），需大于 MODEL_DEADLINE
+- GUNICORN_MAX_REQUESTS：处理多少个请求后轮换 worker，默认 0（不轮换）
+- PORT：监听端口
+
+平滑重载：向 master 进程发送 SIGHUP，新 worker 启动后旧 worker 处理完当前请求再退出。
+
+异步任务（/api/jobs）在提交它的 worker 进程内执行：worker 退出前最多等待
+JOB_SHUTDOWN_TIMEOUT 秒让排队中和执行中的任务完成，graceful_timeout 默认比它多 10 秒，
+避免任务被强制结束；轮换 worker 会让任务的完成时间变长，因此默认不按请求数轮换。
+"""
+import multiprocessing
+import os
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', max(2, multiprocessing.cpu_count())))
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+# gevent 等协程 worker 用 worker_connections 控制并发
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get(
+    'GUNICORN_GRACEFUL_TIMEOUT', float(os.environ.get('JOB_SHUTDOWN_TIMEOUT', 150)) + 10
+))
+keepalive = 5
+
+# 定期轮换 worker 可释放长时间运行积累的内存（抖动避免所有 worker 同时重启）；
+# 异步任务在 worker 内执行，轮换时需等待任务完成，默认关闭
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# 不预加载：每个 worker 自行导入 app，任务线程、写回线程等在 worker 内启动
+preload_app = False
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
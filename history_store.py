@@ -0,0 +1,709 @@
+"""历史记录存储 - 基于 SQLite 的索引化存储
+
+替代原先整文件读写的 data/history.json：
+插入、重命名、删除都只触及单行（主键/唯一索引，O(log n)），
+不再随历史总量增长而变慢。
+
+多个 gunicorn worker 可同时写入：写操作都在 BEGIN IMMEDIATE 事务中执行，
+由 SQLite 的文件锁在进程间串行化，WAL 日志保证进程崩溃时不会损坏数据。
+"""
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from search_index import INDEX_VERSION, build_match_query, document_fields, make_snippet
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    user_context TEXT NOT NULL DEFAULT '',
+    images TEXT NOT NULL DEFAULT '[]',
+    analyses TEXT NOT NULL DEFAULT '[]',
+    styles TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(name, user_context, body, content='');
+CREATE TABLE IF NOT EXISTS image_refs (
+    path TEXT PRIMARY KEY,
+    refs INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS archive (
+    id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    images TEXT NOT NULL DEFAULT '[]',
+    segment TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS maintenance (
+    task TEXT PRIMARY KEY,
+    last_run REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    id TEXT NOT NULL,
+    changed_at REAL NOT NULL
+);
+"""
+
+# 检索排序时各列的权重：名称 > 补充说明 > 分析正文
+SEARCH_WEIGHTS = (5.0, 2.0, 1.0)
+
+RECORD_COLUMNS = 'id, timestamp, name, user_context, images, analyses'
+SUMMARY_COLUMNS = 'seq, id, timestamp, name, styles'
+
+logger = logging.getLogger(__name__)
+
+# 等待其它进程释放写锁的最长时间（秒）
+BUSY_TIMEOUT = 30
+
+# 变更日志保留的条数；客户端的版本早于保留范围时需要重新加载完整列表
+CHANGE_LOG_KEEP = 10000
+# 每写入多少条变更裁剪一次日志（不依赖保留策略是否开启）
+CHANGE_LOG_TRIM_EVERY = 100
+
+_id_counter = itertools.count()
+
+
+def new_record_id():
+    """生成历史记录 id：时间 + 进程号 + 进程内序号，多进程同一微秒内也不重复"""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}_{next(_id_counter)}"
+
+
+class HistoryStore:
+    """SQLite 历史记录存储，每个线程持有独立连接"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._write() as conn:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+            self._migrate_schema(conn)
+            if 'history_fts' not in tables or conn.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+                self._rebuild_index(conn, 'history_fts' in tables)
+            if 'image_refs' not in tables:
+                self._rebuild_image_refs(conn)
+
+    def _conn(self):
+        """获取当前线程的数据库连接（自动提交模式，事务由 _write 显式管理）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """写事务：BEGIN IMMEDIATE 立即获取写锁，避免读锁升级时的死锁"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _migrate_schema(self, conn):
+        """为旧版数据库补充 styles 列（摘要查询无需解析 analyses）"""
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+        if 'styles' in columns:
+            return
+        conn.execute("ALTER TABLE history ADD COLUMN styles TEXT NOT NULL DEFAULT '[]'")
+        rows = conn.execute('SELECT seq, analyses FROM history').fetchall()
+        conn.executemany(
+            'UPDATE history SET styles = ? WHERE seq = ?',
+            [(self._styles_json(json.loads(analyses)), seq) for seq, analyses in rows]
+        )
+
+    def _rebuild_index(self, conn, existing=False):
+        """为已有记录建立全文索引（首次启用检索或分词规则变化时执行一次）"""
+        if existing:
+            # contentless 表无法按旧规则逐条删除，整表重建
+            conn.execute('DROP TABLE history_fts')
+            conn.execute("CREATE VIRTUAL TABLE history_fts USING fts5(name, user_context, body, content='')")
+        rows = conn.execute('SELECT seq, name, user_context, analyses FROM history')
+        for seq, name, user_context, analyses in rows.fetchall():
+            self._index(conn, seq, name, user_context, json.loads(analyses))
+        conn.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+
+    def _rebuild_image_refs(self, conn):
+        """统计已有记录对上传图片的引用次数"""
+        for (images,) in conn.execute('SELECT images FROM history').fetchall():
+            self._add_image_refs(conn, json.loads(images), 1)
+
+    @staticmethod
+    def _add_image_refs(conn, images, delta):
+        conn.executemany(
+            'INSERT INTO image_refs (path, refs) VALUES (?, ?) '
+            'ON CONFLICT(path) DO UPDATE SET refs = refs + excluded.refs',
+            [(path, delta) for path in set(images)]
+        )
+
+    @staticmethod
+    def _index(conn, seq, name, user_context, analyses):
+        conn.execute(
+            'INSERT INTO history_fts (rowid, name, user_context, body) VALUES (?, ?, ?, ?)',
+            (seq, *document_fields(name, user_context, analyses))
+        )
+
+    @staticmethod
+    def _unindex(conn, seq, name, user_context, analyses):
+        # contentless 表删除时需要提供与写入时相同的内容
+        conn.execute(
+            "INSERT INTO history_fts (history_fts, rowid, name, user_context, body) VALUES ('delete', ?, ?, ?, ?)",
+            (seq, *document_fields(name, user_context, analyses))
+        )
+
+    def _insert_row(self, conn, record, ignore_existing=False):
+        verb = 'INSERT OR IGNORE' if ignore_existing else 'INSERT'
+        cur = conn.execute(
+            f'{verb} INTO history ({RECORD_COLUMNS}, styles) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self._record_to_row(record)
+        )
+        if cur.rowcount > 0:
+            self._index(
+                conn, cur.lastrowid, record.get('name', ''),
+                record.get('user_context', '') or '', record.get('analyses', [])
+            )
+            self._add_image_refs(conn, record.get('images', []), 1)
+            self._log_change(conn, 'upsert', record['id'])
+        return cur.rowcount > 0
+
+    @staticmethod
+    def _log_change(conn, op, record_id):
+        # 与数据修改在同一事务中写入，版本号即变更日志的自增序号
+        version = conn.execute(
+            'INSERT INTO changes (op, id, changed_at) VALUES (?, ?, ?)', (op, record_id, time.time())
+        ).lastrowid
+        if version % CHANGE_LOG_TRIM_EVERY == 0:
+            conn.execute('DELETE FROM changes WHERE version <= ?', (version - CHANGE_LOG_KEEP,))
+
+    @staticmethod
+    def _styles_json(analyses):
+        return json.dumps([a.get('style', '') for a in analyses], ensure_ascii=False)
+
+    @staticmethod
+    def _row_to_record(row):
+        return {
+            'id': row[0],
+            'timestamp': row[1],
+            'name': row[2],
+            'user_context': row[3],
+            'images': json.loads(row[4]),
+            'analyses': json.loads(row[5])
+        }
+
+    @staticmethod
+    def _record_to_row(record):
+        return (
+            record['id'],
+            record['timestamp'],
+            record.get('name', ''),
+            record.get('user_context', '') or '',
+            json.dumps(record.get('images', []), ensure_ascii=False),
+            json.dumps(record.get('analyses', []), ensure_ascii=False),
+            HistoryStore._styles_json(record.get('analyses', []))
+        )
+
+    def insert(self, record):
+        """插入一条记录"""
+        with self._write() as conn:
+            self._insert_row(conn, record)
+        return record['id']
+
+    def insert_many(self, records):
+        """在一个事务中插入多条记录，返回 id 列表"""
+        with self._write() as conn:
+            for record in records:
+                self._insert_row(conn, record)
+        return [record['id'] for record in records]
+
+    def get(self, record_id):
+        """按 id 获取完整记录，不存在返回 None"""
+        row = self._conn().execute(
+            f'SELECT {RECORD_COLUMNS} FROM history WHERE id = ?', (record_id,)
+        ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def list_summaries(self, limit=50, cursor=None, name=None, since=None, until=None):
+        """分页获取记录摘要（最新的在前面）
+
+        基于 seq 的游标分页：cursor 为上一页最后一条的 seq，
+        每页只读取 limit 行，且不读取 analyses 正文。
+        返回 (摘要列表, 下一页游标或 None)。
+        """
+        clauses = []
+        params = []
+        if cursor is not None:
+            clauses.append('seq < ?')
+            params.append(cursor)
+        if name:
+            escaped = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+        if since:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            clauses.append('timestamp <= ?')
+            params.append(until)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._conn().execute(
+            f'SELECT {SUMMARY_COLUMNS} FROM history {where} ORDER BY seq DESC LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        summaries = [
+            {'id': row[1], 'timestamp': row[2], 'name': row[3], 'styles': json.loads(row[4])}
+            for row in rows[:limit]
+        ]
+        return summaries, next_cursor
+
+    def search(self, query, limit=20, offset=0):
+        """全文检索名称、补充说明和分析正文，按相关度排序
+
+        返回 (命中列表, 下一页 offset 或 None)。
+        """
+        match = build_match_query(query)
+        if match is None:
+            return [], None
+
+        rows = self._conn().execute(
+            f"""
+            SELECT h.id, h.timestamp, h.name, h.styles, h.user_context, h.analyses, f.score
+            FROM (
+                SELECT rowid, bm25(history_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) AS score
+                FROM history_fts WHERE history_fts MATCH ?
+                ORDER BY score LIMIT ? OFFSET ?
+            ) AS f
+            JOIN history AS h ON h.seq = f.rowid
+            ORDER BY f.score
+            """,
+            (match, limit + 1, offset)
+        ).fetchall()
+
+        hits = []
+        for record_id, timestamp, name, styles, user_context, analyses, score in rows[:limit]:
+            body = '\n'.join(a.get('analysis', '') for a in json.loads(analyses))
+            source = next(
+                (text for text in (name, user_context, body)
+                 if any(term.lower() in text.lower() for term in query.split())),
+                body
+            )
+            hits.append({
+                'id': record_id,
+                'timestamp': timestamp,
+                'name': name,
+                'styles': json.loads(styles),
+                'score': round(-score, 4),
+                'snippet': make_snippet(source, query)
+            })
+        return hits, (offset + limit if len(rows) > limit else None)
+
+    def count(self):
+        """记录总数"""
+        return self._conn().execute('SELECT COUNT(*) FROM history').fetchone()[0]
+
+    def delete(self, record_id):
+        """删除记录（包括已归档的记录），返回是否存在该记录
+
+        记录引用的图片只减少引用计数，由保留策略的垃圾回收统一清理。
+        """
+        with self._write() as conn:
+            row = conn.execute(
+                'SELECT seq, name, user_context, analyses, images FROM history WHERE id = ?', (record_id,)
+            ).fetchone()
+            if row is None:
+                archived = conn.execute('SELECT images FROM archive WHERE id = ?', (record_id,)).fetchone()
+                if archived is None:
+                    return False
+                conn.execute('DELETE FROM archive WHERE id = ?', (record_id,))
+                self._add_image_refs(conn, json.loads(archived[0]), -1)
+                # 已归档的记录仍可按 id 读取，删除同样要更新版本，缓存的详情不会继续返回 304
+                self._log_change(conn, 'delete', record_id)
+                return True
+
+            self._unindex(conn, row[0], row[1], row[2], json.loads(row[3]))
+            conn.execute('DELETE FROM history WHERE seq = ?', (row[0],))
+            self._add_image_refs(conn, json.loads(row[4]), -1)
+            self._log_change(conn, 'delete', record_id)
+        return True
+
+    def rename(self, record_id, new_name):
+        """重命名记录，返回是否存在该记录"""
+        with self._write() as conn:
+            row = conn.execute(
+                'SELECT seq, name, user_context, analyses FROM history WHERE id = ?', (record_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            analyses = json.loads(row[3])
+            self._unindex(conn, row[0], row[1], row[2], analyses)
+            conn.execute('UPDATE history SET name = ? WHERE seq = ?', (new_name, row[0]))
+            self._index(conn, row[0], new_name, row[2], analyses)
+            self._log_change(conn, 'upsert', record_id)
+        return True
+
+    def version(self):
+        """当前数据版本 (版本号, 最后修改时间戳)；尚无变更时为 (0, None)
+
+        每次插入、重命名、删除、归档都会使版本号加一，用于条件请求和增量同步。
+        """
+        row = self._conn().execute(
+            'SELECT version, changed_at FROM changes ORDER BY version DESC LIMIT 1'
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def cache_tag(self):
+        """条件请求使用的 (ETag, 最后修改时间戳, 数据版本)，数据变化时 ETag 随之变化"""
+        version, changed_at = self.version()
+        return f'h{version}', changed_at, version
+
+    def changes_since(self, since, limit=500):
+        """获取版本 since 之后的变更，同一记录只保留最后一次
+
+        返回 (变更列表, 本次同步到的版本, 是否需要重新加载)。
+        upsert 带记录摘要，delete 只有 id；since 早于日志保留范围或晚于当前版本
+        （数据库被重建）时返回需要重新加载。
+        """
+        conn = self._conn()
+        first, last = conn.execute('SELECT MIN(version), MAX(version) FROM changes').fetchone()
+        last = last or 0
+        if since > last or (first is not None and since < first - 1):
+            return [], last, True
+
+        rows = conn.execute(
+            'SELECT c.version, c.op, c.id, h.timestamp, h.name, h.styles FROM changes c '
+            'JOIN (SELECT MAX(version) AS version FROM changes WHERE version > ? GROUP BY id) m '
+            'ON c.version = m.version '
+            'LEFT JOIN history h ON h.id = c.id '
+            'ORDER BY c.version LIMIT ?',
+            (since, limit + 1)
+        ).fetchall()
+        if len(rows) > limit:
+            # 还有更多：只同步到本页最后一条变更的版本
+            rows = rows[:limit]
+            last = rows[-1][0]
+
+        changes = []
+        for version, op, record_id, timestamp, name, styles in rows:
+            if op == 'upsert' and timestamp is not None:
+                changes.append({
+                    'op': 'upsert', 'version': version,
+                    'record': {'id': record_id, 'timestamp': timestamp, 'name': name, 'styles': json.loads(styles)}
+                })
+            else:
+                changes.append({'op': 'delete', 'version': version, 'id': record_id})
+        return changes, last, False
+
+    def migrate_json(self, json_path, only_if_empty=False):
+        """从旧版 history.json 导入记录，返回导入条数（已存在的 id 跳过）
+
+        only_if_empty 时仅在数据库为空时导入；检查与导入在同一写事务中，
+        多个 worker 同时启动也只会导入一次。
+        """
+        with open(json_path, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+
+        with self._write() as conn:
+            if only_if_empty and conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]:
+                return 0
+            # history.json 最新的在前面，倒序插入以保持 seq 与时间顺序一致
+            return sum(self._insert_row(conn, record, ignore_existing=True) for record in reversed(history))
+
+    def oldest_records(self, limit, before=None):
+        """按时间从旧到新获取完整记录（归档用），before 为时间上限"""
+        rows = self._conn().execute(
+            f'SELECT {RECORD_COLUMNS} FROM history WHERE (? IS NULL OR timestamp < ?) ORDER BY seq LIMIT ?',
+            (before, before, limit)
+        ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def archive_records(self, records, segment):
+        """把已写入归档分段的记录移出在线存储（图片引用保持不变）"""
+        with self._write() as conn:
+            for record in records:
+                row = conn.execute(
+                    'SELECT seq, name, user_context, analyses FROM history WHERE id = ?', (record['id'],)
+                ).fetchone()
+                if row is None:
+                    continue
+                self._unindex(conn, row[0], row[1], row[2], json.loads(row[3]))
+                conn.execute('DELETE FROM history WHERE seq = ?', (row[0],))
+                self._log_change(conn, 'delete', record['id'])
+                conn.execute(
+                    'INSERT OR REPLACE INTO archive (id, timestamp, name, images, segment) VALUES (?, ?, ?, ?, ?)',
+                    (record['id'], record['timestamp'], row[1],
+                     json.dumps(record.get('images', []), ensure_ascii=False), segment)
+                )
+
+    def archived_segment(self, record_id):
+        """已归档记录所在的分段文件名，未归档返回 None"""
+        row = self._conn().execute('SELECT segment FROM archive WHERE id = ?', (record_id,)).fetchone()
+        return row[0] if row else None
+
+    def archive_segments(self):
+        """每个归档分段中仍保留的记录 id {分段文件名: id 集合}"""
+        segments = {}
+        for record_id, segment in self._conn().execute('SELECT id, segment FROM archive'):
+            segments.setdefault(segment, set()).add(record_id)
+        return segments
+
+    def image_ref_counts(self):
+        """所有被引用图片的引用次数 {路径: 次数}"""
+        return dict(self._conn().execute('SELECT path, refs FROM image_refs WHERE refs > 0').fetchall())
+
+    def drop_image_refs(self, paths):
+        """清除已删除图片的引用计数行"""
+        with self._write() as conn:
+            conn.executemany('DELETE FROM image_refs WHERE path = ? AND refs <= 0', [(p,) for p in paths])
+
+    def claim_maintenance(self, task, interval):
+        """多进程间协调定期任务：距上次执行不足 interval 秒时返回 False"""
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute('SELECT last_run FROM maintenance WHERE task = ?', (task,)).fetchone()
+            if row is not None and now - row[0] < interval:
+                return False
+            conn.execute('INSERT OR REPLACE INTO maintenance (task, last_run) VALUES (?, ?)', (task, now))
+        return True
+
+    def compact(self, vacuum=False, merge_pages=500):
+        """整理存储：合并全文索引段、裁剪变更日志、截断 WAL；vacuum 会重写整个文件并短暂阻塞写入"""
+        conn = self._conn()
+        with self._write():
+            # 有界的增量合并，避免一次 optimize 占用过长时间
+            conn.execute("INSERT INTO history_fts (history_fts, rank) VALUES ('merge', ?)", (merge_pages,))
+            conn.execute(
+                'DELETE FROM changes WHERE version <= (SELECT MAX(version) FROM changes) - ?', (CHANGE_LOG_KEEP,)
+            )
+        if vacuum:
+            conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def set_synchronous(self, mode):
+        """设置当前线程连接的同步级别（FULL 表示每次提交都 fsync）"""
+        self._conn().execute(f'PRAGMA synchronous={mode}')
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class WriteBehindHistory:
+    """写回缓冲：新记录先放在内存队列中，由后台线程分组提交
+
+    达到 max_batch 条或等待 max_delay 秒后，一组记录在一个事务中写入并 fsync 一次。
+    读取时合并尚未写入的记录，保证刚保存的记录立即可见；
+    重命名、删除等操作先刷新队列，保证操作顺序。
+    进程退出前调用 close() 写完剩余记录。
+    """
+
+    def __init__(self, store, max_batch=100, max_delay=0.2):
+        self.store = store
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = OrderedDict()
+        self._flushing = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        # 进程内新增记录的序号与时间，用于在不刷新队列的情况下生成 ETag
+        self._inserted = 0
+        self._last_insert = None
+        self.flushes = 0
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        # 其它方法直接交给底层存储
+        return getattr(self.store, name)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+                # 攒够一组或等到时间窗口结束
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('历史记录写入失败，稍后重试')
+                time.sleep(self.max_delay)
+
+    def flush(self):
+        """把队列中的记录写入存储（一个事务，提交时 fsync）
+
+        读取、重命名等操作也会在调用线程中先刷新队列，因此同步级别在每次写入时
+        对当前线程的连接临时设为 FULL，而不只设置后台线程的连接。
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return
+                batch = self._pending
+                self._flushing = batch
+                self._pending = OrderedDict()
+            try:
+                self.store.set_synchronous('FULL')
+                try:
+                    self.store.insert_many(list(batch.values()))
+                finally:
+                    self.store.set_synchronous('NORMAL')
+            except BaseException:
+                # 写入失败时放回队列，下次重试
+                with self._cond:
+                    batch.update(self._pending)
+                    self._pending = batch
+                raise
+            finally:
+                with self._cond:
+                    self._flushing = {}
+            self.flushes += 1
+
+    def close(self):
+        """停止后台线程并写完剩余记录"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def _unflushed(self):
+        """尚未写入存储的记录，最新的在前面"""
+        with self._cond:
+            records = list(self._flushing.values()) + list(self._pending.values())
+        return records[::-1]
+
+    def insert(self, record):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('历史记录写入队列已关闭')
+            self._pending[record['id']] = record
+            self._inserted += 1
+            self._last_insert = time.time()
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        return record['id']
+
+    def insert_many(self, records):
+        for record in records:
+            self.insert(record)
+        return [record['id'] for record in records]
+
+    def get(self, record_id):
+        with self._cond:
+            record = self._pending.get(record_id) or self._flushing.get(record_id)
+        return record if record is not None else self.store.get(record_id)
+
+    def count(self):
+        return self.store.count() + len(self._unflushed())
+
+    def list_summaries(self, limit=50, cursor=None, name=None, since=None, until=None):
+        summaries, next_cursor = self.store.list_summaries(limit, cursor, name, since, until)
+        if cursor is not None:
+            return summaries, next_cursor
+
+        # 第一页：把尚未写入的记录放在最前面
+        unflushed = [
+            {
+                'id': r['id'],
+                'timestamp': r['timestamp'],
+                'name': r['name'],
+                'styles': [a.get('style', '') for a in r.get('analyses', [])]
+            }
+            for r in self._unflushed()
+            if (not name or name in r['name'])
+            and (not since or r['timestamp'] >= since)
+            and (not until or r['timestamp'] <= until)
+        ]
+        ids = {s['id'] for s in unflushed}
+        summaries = [s for s in summaries if s['id'] not in ids]
+        if not unflushed:
+            return summaries, next_cursor
+        if len(unflushed) + len(summaries) <= limit:
+            return unflushed + summaries, next_cursor
+
+        self.flush()
+        return self.store.list_summaries(limit, cursor, name, since, until)
+
+    def search(self, query, limit=20, offset=0):
+        self.flush()
+        return self.store.search(query, limit, offset)
+
+    def cache_tag(self):
+        # 不刷新队列（否则每次条件请求都要在请求线程中提交并 fsync）：
+        # 有尚未写入的记录时，ETag 附加本进程的新增序号
+        with self._cond:
+            pending = bool(self._pending or self._flushing)
+            inserted, last_insert = self._inserted, self._last_insert
+        etag, changed_at, version = self.store.cache_tag()
+        if not pending:
+            return etag, changed_at, version
+        return f'{etag}-{os.getpid()}.{inserted}', max(changed_at or 0, last_insert), version
+
+    def changes_since(self, since, limit=500):
+        # 不刷新队列：尚未写入的记录作为 upsert 附加在最后一页，同步到的版本仍是已写入的版本，
+        # 写入后下次同步会再收到一次这些记录（upsert 是幂等的）
+        changes, synced, reset = self.store.changes_since(since, limit)
+        if reset or len(changes) >= limit:
+            return changes, synced, reset
+        for record in self._unflushed()[::-1]:
+            changes.append({'op': 'upsert', 'version': None, 'record': {
+                'id': record['id'],
+                'timestamp': record['timestamp'],
+                'name': record['name'],
+                'styles': [a.get('style', '') for a in record.get('analyses', [])]
+            }})
+        return changes, synced, reset
+
+    def delete(self, record_id):
+        self.flush()
+        return self.store.delete(record_id)
+
+    def rename(self, record_id, new_name):
+        self.flush()
+        return self.store.rename(record_id, new_name)
+
+
+if __name__ == '__main__':
+    # 用法: python history_store.py migrate [history.json] [history.db]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('用法: python history_store.py migrate [history.json] [history.db]')
+        sys.exit(1)
+
+    json_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join('data', 'history.json')
+    db_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join('data', 'history.db')
+    imported = HistoryStore(db_path).migrate_json(json_path)
+    print(f'已导入 {imported} 条记录到 {db_path}')
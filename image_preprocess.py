@@ -0,0 +1,103 @@
+"""图片预处理 - 分析前缩放、重新编码并去除元数据
+
+原图（如 4K 截图）按最长边缩放到 max_edge，重新编码为 WebP 或 JPEG，
+不保留 EXIF 等元数据。处理结果按原图内容哈希 + 参数缓存在
+uploads/derived/ 下，同一张图片只处理一次。
+需要 Pillow；未安装时直接使用原图。
+"""
+import os
+import tempfile
+
+from image_store import UploadRejected
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - Pillow 未安装时跳过预处理
+    Image = None
+
+
+FORMATS = {
+    'webp': ('WEBP', '.webp'),
+    'jpeg': ('JPEG', '.jpg')
+}
+
+
+def image_pixels(path):
+    """从文件头读取图片尺寸，返回像素数（不解码像素数据）；无法识别或未安装 Pillow 时返回 None"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            return img.width * img.height
+    except Image.DecompressionBombError:
+        # 超过 Pillow 自身上限两倍的图片在打开时即被拒绝
+        return float('inf')
+    except OSError:
+        return None
+
+
+class ImagePreprocessor:
+    """分析前的图片缩放与压缩"""
+
+    def __init__(self, folder, max_edge=1568, fmt='webp', quality=85):
+        if fmt not in FORMATS:
+            raise ValueError(f'不支持的输出格式: {fmt}')
+        self.folder = folder
+        self.max_edge = max_edge
+        self.fmt = fmt
+        self.quality = quality
+        self.enabled = Image is not None
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def variant(self):
+        """处理参数标识，参与派生文件命名"""
+        return f'{self.fmt}{self.max_edge}q{self.quality}'
+
+    def derived_path(self, digest):
+        return os.path.join(self.folder, f'{digest}-{self.variant}{FORMATS[self.fmt][1]}')
+
+    def _render(self, src_path, dst_path):
+        with Image.open(src_path) as img:
+            img.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            pil_format = FORMATS[self.fmt][0]
+            if pil_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                # JPEG 不支持透明通道，铺白底
+                rgba = img.convert('RGBA')
+                img = Image.new('RGB', rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.split()[3])
+            elif pil_format == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.derived_')
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    # 不传 exif/icc_profile，元数据不会写入输出
+                    img.save(tmp, format=pil_format, quality=self.quality, method=4 if pil_format == 'WEBP' else 0)
+                os.replace(tmp_path, dst_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def prepare(self, src_path, digest):
+        """返回用于分析的图片路径
+
+        处理后不比原图小时（原图本身已足够小）继续使用原图。
+        """
+        if not self.enabled:
+            return src_path
+
+        dst_path = self.derived_path(digest)
+        if not os.path.exists(dst_path):
+            try:
+                self._render(src_path, dst_path)
+            except OSError:
+                # 图片损坏或格式无法解码时交给模型直接处理原图
+                return src_path
+            except Image.DecompressionBombError:
+                raise UploadRejected('图片尺寸过大', 413)
+
+        if os.path.getsize(dst_path) >= os.path.getsize(src_path):
+            return src_path
+        return dst_path
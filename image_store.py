@@ -0,0 +1,222 @@
+"""上传图片存储 - 按内容哈希去重，并缓存 base64 编码结果
+
+同一张图片无论上传多少次，磁盘上只保存一份 uploads/<sha256>.<ext>；
+编码结果以内容哈希为键放入有界 LRU 缓存，同一请求的多个风格、
+以及跨请求的重复上传都不再重复读盘和编码。
+
+UploadSpool 用于流式接收上传：multipart 数据边到达边写入上传目录的临时文件，
+同时计算哈希、按文件头识别图片格式并限制单文件大小，内存占用与文件大小无关。
+"""
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+CHUNK_SIZE = 64 * 1024
+# 内容寻址文件名：<sha256> 或预处理派生文件 <sha256>-<参数>
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}(-[a-z0-9]+)?$')
+
+# 识别图片格式所需的文件头长度
+HEADER_SIZE = 12
+
+
+def sniff_image_type(header):
+    """根据文件头（magic bytes）识别图片格式，返回扩展名，非图片返回 None"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return '.gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+class UploadRejected(Exception):
+    """上传内容不符合要求，status 为建议的 HTTP 状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class UploadSpool:
+    """流式接收单个上传文件：写入临时文件、计算哈希、校验文件头与大小"""
+
+    def __init__(self, folder, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.image_type = None
+        fd, self.tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload_')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hasher = hashlib.sha256()
+        self._header = b''
+        self._committed = False
+
+    def _check_header(self):
+        self.image_type = sniff_image_type(self._header)
+        if self.image_type is None:
+            raise UploadRejected('只支持 JPG、PNG、GIF、WebP 格式的图片', 415)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadRejected(f'单个图片不能超过 {self.max_bytes // (1024 * 1024)}MB', 413)
+
+        if self.image_type is None and len(self._header) < HEADER_SIZE:
+            self._header += data[:HEADER_SIZE - len(self._header)]
+            if len(self._header) >= HEADER_SIZE:
+                self._check_header()
+
+        self._hasher.update(data)
+        return self._file.write(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def commit(self, folder):
+        """把临时文件移动到内容寻址路径，返回存储路径"""
+        if self.image_type is None:
+            # 文件小于 HEADER_SIZE 时在这里补做校验
+            self._check_header()
+
+        self._file.close()
+        path = os.path.join(folder, self._hasher.hexdigest() + self.image_type)
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+            # 刷新修改时间，避免垃圾回收删除正被重新使用的图片
+            os.utime(path)
+        else:
+            os.replace(self.tmp_path, path)
+        self._committed = True
+        return path
+
+    def close(self):
+        """关闭文件；未提交的临时文件（如请求被拒绝）直接删除"""
+        self._file.close()
+        if not self._committed and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ImageStore:
+    """按内容寻址的图片存储"""
+
+    def __init__(self, folder, cache_max_bytes=64 * 1024 * 1024):
+        self.folder = folder
+        self.cache_max_bytes = cache_max_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _extension(filename):
+        ext = os.path.splitext(filename or '')[1].lower()
+        return ext if re.match(r'^\.[a-z0-9]{1,5}$', ext) else ''
+
+    def save(self, file):
+        """保存上传文件（werkzeug FileStorage），返回存储路径
+
+        流式接收的文件（UploadSpool）直接提交；其它文件边读边计算哈希
+        写入临时文件，内容已存在时直接丢弃临时文件。
+        """
+        if isinstance(file.stream, UploadSpool):
+            return file.stream.commit(self.folder)
+
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.upload_')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = file.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+
+            path = os.path.join(self.folder, hasher.hexdigest() + self._extension(file.filename))
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                os.utime(path)
+            else:
+                os.replace(tmp_path, path)
+            return path
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def digest_of(self, path):
+        """获取图片内容标识；内容寻址路径直接取文件名，旧文件则读盘计算哈希"""
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if DIGEST_PATTERN.match(stem):
+            return stem
+
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def encode(self, path):
+        """返回图片的 base64 编码，命中缓存时不读盘
+
+        同一张图片的多个风格并发请求时只编码一次，其余请求等待并共享结果（计为命中）。
+        """
+        digest = self.digest_of(path)
+        with self._lock:
+            encoded = self._cache.get(digest)
+            if encoded is not None:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return encoded
+            entry = self._inflight.get(digest)
+            leader = entry is None
+            if leader:
+                entry = self._inflight[digest] = {'event': threading.Event(), 'encoded': None}
+                self.misses += 1
+        if not leader:
+            entry['event'].wait()
+            if entry['encoded'] is not None:
+                with self._lock:
+                    self.hits += 1
+                return entry['encoded']
+            # 首个请求编码失败时自行重试，错误由本请求抛出
+            return self._read_encoded(path)
+
+        try:
+            encoded = entry['encoded'] = self._read_encoded(path)
+            with self._lock:
+                if digest not in self._cache and len(encoded) <= self.cache_max_bytes:
+                    self._cache[digest] = encoded
+                    self._cache_bytes += len(encoded)
+                    while self._cache_bytes > self.cache_max_bytes:
+                        _, evicted = self._cache.popitem(last=False)
+                        self._cache_bytes -= len(evicted)
+        finally:
+            with self._lock:
+                del self._inflight[digest]
+            entry['event'].set()
+        return encoded
+
+    @staticmethod
+    def _read_encoded(path):
+        with open(path, 'rb') as f:
+            return base64.standard_b64encode(f.read()).decode('utf-8')
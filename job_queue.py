@@ -0,0 +1,234 @@
+"""分析任务队列 - 本地线程池执行，无需外部消息中间件
+
+提交后立即返回任务 id，由后台工作线程执行；任务状态保存在 SQLite 中，
+任意 gunicorn worker 都能查询进度。队列有长度上限，满时拒绝新任务。
+
+任务只在提交它的进程内执行，进程定期为自己的任务写入心跳。worker 退出时
+不再接受新任务，排队中和执行中的任务在限定时间内继续执行完，超时仍未完成的
+标记为失败；进程被强制结束时，心跳超时的任务由其它进程在启动或查询时标记为失败，
+客户端不会一直轮询到不会变化的进度。
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    owner INTEGER,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at);
+"""
+
+# 心跳间隔（秒）；超过 STALE_AFTER 秒没有心跳的排队/执行中任务视为所在进程已退出
+HEARTBEAT_INTERVAL = 5
+STALE_AFTER = 30
+
+
+class QueueFull(Exception):
+    """任务队列已满"""
+
+
+class JobQueue:
+    """有界任务队列 + 工作线程池
+
+    run_job(payload, progress) 执行任务并返回可 JSON 序列化的结果，
+    progress(completed, total) 用于上报进度；抛出异常视为任务失败。
+    """
+
+    def __init__(self, db_path, run_job, workers=2, max_queue=20, result_ttl=3600):
+        self.db_path = db_path
+        self.run_job = run_job
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._workers = []
+        self._pid = os.getpid()
+        self._closing = False
+        self._stopped = threading.Event()
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self._migrate_schema(conn)
+        conn.commit()
+        self._fail_stale()
+
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+
+    @staticmethod
+    def _migrate_schema(conn):
+        """为旧版数据库补充 owner / heartbeat 列"""
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+        if 'owner' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+        if 'heartbeat' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        conn = self._conn()
+        with conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def _fail_stale(self, job_id=None):
+        """把心跳超时的排队/执行中任务标记为失败（所在进程已退出），可只检查指定任务"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                "WHERE status IN ('queued', 'running') AND COALESCE(heartbeat, updated_at) < ? "
+                "AND (? IS NULL OR id = ?)",
+                ('任务所在进程已退出，请重新提交', now, now - STALE_AFTER, job_id, job_id)
+            )
+
+    def _heartbeat(self):
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                conn = self._conn()
+                with conn:
+                    conn.execute(
+                        "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                        (time.time(), self._pid)
+                    )
+            except sqlite3.Error:
+                pass
+
+    def depth(self):
+        """当前排队中的任务数（本进程）"""
+        return self._queue.qsize()
+
+    def submit(self, payload, total=0, runner=None):
+        """提交任务，返回任务 id；队列已满或进程正在退出时抛出 QueueFull
+
+        runner 可替代构造时的 run_job 执行本任务（如带上提交请求的上下文）。
+        """
+        if self._closing:
+            raise QueueFull()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, created_at, updated_at, total, owner, heartbeat) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, 'queued', now, now, total, self._pid, now)
+            )
+            # 顺便清理过期的已完成任务
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (now - self.result_ttl,)
+            )
+
+        try:
+            self._queue.put_nowait((job_id, payload, runner or self.run_job))
+        except queue.Full:
+            with conn:
+                conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+            raise QueueFull()
+        return job_id
+
+    def get(self, job_id):
+        """查询任务状态，不存在返回 None"""
+        query = ('SELECT id, status, created_at, updated_at, completed, total, result, error, heartbeat '
+                 'FROM jobs WHERE id = ?')
+        row = self._conn().execute(query, (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row[1] in ('queued', 'running') and (row[8] or row[3]) < time.time() - STALE_AFTER:
+            self._fail_stale(job_id)
+            row = self._conn().execute(query, (job_id,)).fetchone()
+        return {
+            'id': row[0],
+            'status': row[1],
+            'created_at': row[2],
+            'updated_at': row[3],
+            'progress': {'completed': row[4], 'total': row[5]},
+            'result': json.loads(row[6]) if row[6] else None,
+            'error': row[7]
+        }
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            job_id, payload, run_job = item
+            try:
+                self._update(job_id, status='running')
+                result = run_job(
+                    payload,
+                    lambda completed, total: self._update(job_id, completed=completed, total=total)
+                )
+                self._update(job_id, status='done', result=json.dumps(result, ensure_ascii=False))
+            except Exception as e:
+                self._update(job_id, status='failed', error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def close(self, timeout=150):
+        """进程退出前调用：不再接受新任务，最多等待 timeout 秒让排队中和执行中的任务完成，
+        仍未完成的标记为失败"""
+        if self._closing:
+            return
+        self._closing = True
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._update(item[0], status='failed', error='服务重启，任务已取消，请重新提交')
+            self._queue.task_done()
+
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.monotonic()))
+        self._stopped.set()
+
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                "WHERE owner = ? AND status IN ('queued', 'running')",
+                ('服务重启，任务未完成，请重新提交', time.time(), self._pid)
+            )
@@ -0,0 +1,191 @@
+"""分析结果的 Markdown 渲染 - 服务端生成安全的 HTML
+
+分析完成时渲染一次，HTML 与 Markdown 一起保存到历史记录，浏览器直接显示，
+不用在前端逐次解析长篇报告。旧记录没有 HTML 时按内容哈希渲染并缓存。
+
+只支持分析报告中常见的语法：标题、段落、粗体/斜体/删除线、行内代码与代码块、
+有序/无序列表、引用、分隔线、表格和链接。所有文本先转义再生成标签，
+模型输出中的原始 HTML 不会生效；链接只允许 http(s)、mailto 和站内地址。
+"""
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+
+
+# 渲染规则变化时加一，使缓存中旧规则渲染的结果失效
+RENDER_VERSION = 1
+
+_FENCE = re.compile(r'^\s*(```|~~~)')
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_RULE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+_UNORDERED = re.compile(r'^\s*[-*+]\s+(.*)$')
+_ORDERED = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+_QUOTE = re.compile(r'^\s*>\s?(.*)$')
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+
+_CODE_SPAN = re.compile(r'`([^`]+)`')
+_LINK = re.compile(r'\[([^\]]+)\]\(([^)\s]+)\)')
+_STRONG_EM = re.compile(r'\*\*\*(.+?)\*\*\*')
+_STRONG = re.compile(r'\*\*(.+?)\*\*|__(.+?)__')
+_EM = re.compile(r'\*(.+?)\*')
+_STRIKE = re.compile(r'~~(.+?)~~')
+_SAFE_URL = re.compile(r'^(https?://|mailto:|/|#)', re.IGNORECASE)
+
+
+def _link(match):
+    text, url = match.group(1), match.group(2)
+    if not _SAFE_URL.match(html.unescape(url)):
+        return text
+    return f'<a href="{url}" target="_blank" rel="noopener noreferrer">{text}</a>'
+
+
+def _inline(text):
+    """行内语法；text 为原始文本，先整体转义"""
+    text = html.escape(text)
+    # 行内代码中的内容不再做其它处理，先替换为占位符
+    codes = []
+
+    def stash(match):
+        codes.append(f'<code>{match.group(1)}</code>')
+        return f'\x00{len(codes) - 1}\x00'
+
+    text = _CODE_SPAN.sub(stash, text)
+    text = _LINK.sub(_link, text)
+    text = _STRONG_EM.sub(r'<strong><em>\1</em></strong>', text)
+    text = _STRONG.sub(lambda m: f'<strong>{m.group(1) or m.group(2)}</strong>', text)
+    text = _EM.sub(r'<em>\1</em>', text)
+    text = _STRIKE.sub(r'<del>\1</del>', text)
+    return re.sub('\x00(\\d+)\x00', lambda m: codes[int(m.group(1))], text)
+
+
+def _table_cells(line):
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|'):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split('|')]
+
+
+def render(markdown):
+    """把 Markdown 渲染为 HTML 片段"""
+    if not markdown:
+        return ''
+    lines = markdown.replace('\r\n', '\n').split('\n')
+    out = []
+    paragraph = []
+    i = 0
+
+    def flush_paragraph():
+        if paragraph:
+            out.append('<p>' + '<br>'.join(_inline(line.strip()) for line in paragraph) + '</p>')
+            paragraph.clear()
+
+    while i < len(lines):
+        line = lines[i]
+
+        fence = _FENCE.match(line)
+        if fence:
+            flush_paragraph()
+            code = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                code.append(lines[i])
+                i += 1
+            out.append('<pre><code>' + html.escape('\n'.join(code)) + '</code></pre>')
+            i += 1
+            continue
+
+        if not line.strip():
+            flush_paragraph()
+            i += 1
+            continue
+
+        heading = _HEADING.match(line)
+        if heading:
+            flush_paragraph()
+            level = len(heading.group(1))
+            out.append(f'<h{level}>{_inline(heading.group(2))}</h{level}>')
+            i += 1
+            continue
+
+        if _RULE.match(line):
+            flush_paragraph()
+            out.append('<hr>')
+            i += 1
+            continue
+
+        if '|' in line and i + 1 < len(lines) and _TABLE_SEPARATOR.match(lines[i + 1]) and '-' in lines[i + 1]:
+            flush_paragraph()
+            header = _table_cells(line)
+            rows = []
+            i += 2
+            while i < len(lines) and '|' in lines[i] and lines[i].strip():
+                rows.append(_table_cells(lines[i]))
+                i += 1
+            parts = ['<table><thead><tr>']
+            parts += [f'<th>{_inline(cell)}</th>' for cell in header]
+            parts.append('</tr></thead><tbody>')
+            for row in rows:
+                cells = (row + [''] * len(header))[:len(header)]
+                parts.append('<tr>' + ''.join(f'<td>{_inline(cell)}</td>' for cell in cells) + '</tr>')
+            parts.append('</tbody></table>')
+            out.append(''.join(parts))
+            continue
+
+        for pattern, tag in ((_UNORDERED, 'ul'), (_ORDERED, 'ol')):
+            if pattern.match(line):
+                flush_paragraph()
+                items = []
+                while i < len(lines) and pattern.match(lines[i]):
+                    items.append(f'<li>{_inline(pattern.match(lines[i]).group(1))}</li>')
+                    i += 1
+                out.append(f'<{tag}>' + ''.join(items) + f'</{tag}>')
+                break
+        else:
+            if _QUOTE.match(line):
+                flush_paragraph()
+                quoted = []
+                while i < len(lines) and _QUOTE.match(lines[i]):
+                    quoted.append(_QUOTE.match(lines[i]).group(1))
+                    i += 1
+                out.append('<blockquote>' + render('\n'.join(quoted)) + '</blockquote>')
+                continue
+            paragraph.append(line)
+            i += 1
+
+    flush_paragraph()
+    return '\n'.join(out)
+
+
+class RenderCache:
+    """按内容哈希缓存渲染结果（LRU），用于没有保存 HTML 的旧记录"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(markdown):
+        return hashlib.sha256(f'{RENDER_VERSION}\n{markdown}'.encode('utf-8')).hexdigest()
+
+    def render(self, markdown):
+        key = self.key(markdown)
+        with self._lock:
+            cached = self._items.get(key)
+            if cached is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        result = render(markdown)
+        with self._lock:
+            self._items[key] = result
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return result
@@ -0,0 +1,128 @@
+"""本地模拟 Claude Messages API，用于离线测试模型后端
+
+支持普通响应和流式（SSE）响应、HTTP/1.1 keep-alive，可配置延迟和错误率：
+
+    python mock_server.py --port 8787 --latency 0.5 --error-rate 0.1
+
+然后设置 CLAUDE_API_URL=http://127.0.0.1:8787 和任意 CLAUDE_API_KEY 启动应用。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MOCK_TEXT = """# 模拟分析报告
+
+收到 {images} 张图片。
+
+## 提示词
+{prompt}
+
+## 结论
+- 指标整体呈上升趋势
+- 峰值出现在周期中段
+"""
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, event, data):
+        chunk = f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8')
+        self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+        self.wfile.flush()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        if self.path.rstrip('/') != '/v1/messages':
+            return self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Not found'}})
+        if not self.headers.get('x-api-key'):
+            return self._send_json(401, {'type': 'error', 'error': {'type': 'authentication_error', 'message': 'missing x-api-key'}})
+
+        time.sleep(server.latency)
+        if random.random() < server.error_rate:
+            status = random.choice([429, 500, 529])
+            headers = {'Retry-After': '1'} if status == 429 else None
+            return self._send_json(status, {'type': 'error', 'error': {'type': 'api_error', 'message': 'mock failure'}}, headers)
+
+        payload = json.loads(body)
+        content = payload['messages'][0]['content']
+        text = MOCK_TEXT.format(
+            images=sum(1 for block in content if block['type'] == 'image'),
+            prompt=next((block['text'] for block in content if block['type'] == 'text'), '')
+        )
+        message_id = f'msg_{uuid.uuid4().hex[:24]}'
+
+        if not payload.get('stream'):
+            return self._send_json(200, {
+                'id': message_id, 'type': 'message', 'role': 'assistant', 'model': payload['model'],
+                'content': [{'type': 'text', 'text': text}], 'stop_reason': 'end_turn'
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._send_event('message_start', {'type': 'message_start', 'message': {'id': message_id, 'model': payload['model']}})
+        self._send_event('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for line in text.splitlines(keepends=True):
+            time.sleep(server.chunk_delay)
+            self._send_event('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': line}
+            })
+        self._send_event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self._send_event('message_stop', {'type': 'message_stop'})
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def make_server(host='127.0.0.1', port=8787, latency=0.0, error_rate=0.0, chunk_delay=0.0, verbose=False):
+    """创建模拟服务（未启动），便于在脚本中用 serve_forever 在后台线程运行"""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.chunk_delay = chunk_delay
+    server.verbose = verbose
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='模拟 Claude Messages API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 429/500/529 的概率')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='流式响应每段之间的延迟（秒）')
+    parser.add_argument('--verbose', action='store_true', help='打印访问日志')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.error_rate, args.chunk_delay, args.verbose)
+    print(f'模拟服务已启动: http://{args.host}:{args.port}/v1/messages')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
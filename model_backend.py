@@ -0,0 +1,369 @@
+"""模型后端 - 调用 Claude Messages API
+
+- 连接池：每个进程保持有限个 keep-alive 连接，分析线程间复用，不再每次握手
+- 限流：令牌桶在进程内所有并发分析间共享，控制发往上游的请求速率
+- 重试：429、5xx 和网络错误按指数退避加随机抖动重试，优先遵守 Retry-After
+- 超时：单次调用有读取超时和总时限，远低于 gunicorn 的 300 秒；总时限同样约束正在进行的调用，
+  读取超时不超过剩余时间，流式输出在每个事件之间检查
+- 熔断：连续失败达到阈值后在冷却时间内直接失败，上游变慢时不会占满所有 worker
+
+只依赖标准库；离线测试可用 mock_server.py 代替真实接口。
+"""
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+API_VERSION = '2023-06-01'
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+
+
+class BackendError(Exception):
+    """模型调用失败；retryable 表示是否值得重试，status 为上游 HTTP 状态码"""
+
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 burst 个"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """取一个令牌，超过 timeout 秒仍取不到返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """熔断器：连续 threshold 次失败后打开，reset_timeout 秒后放行一次试探请求"""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """是否放行请求：放行时返回令牌（半开状态下的试探请求为 'probe'），否则返回 None"""
+        with self._lock:
+            if self._opened_at is None:
+                return 'pass'
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return None
+            self._probing = True
+            return 'probe'
+
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self, token):
+        """放行的请求没有发出（如排队超时）时调用；只有试探请求会交还试探机会"""
+        if token != 'probe':
+            return
+        with self._lock:
+            self._probing = False
+
+
+class ConnectionPool:
+    """keep-alive HTTP(S) 连接池，最多 size 个空闲连接"""
+
+    def __init__(self, base_url, size=8, timeout=60, connect_timeout=10):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def new_connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.timeout)
+        return conn
+
+    def acquire(self):
+        """取一个连接，返回 (连接, 是否为复用的空闲连接)"""
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self.new_connection(), False
+
+    @property
+    def idle(self):
+        return self._idle.qsize()
+
+    def release(self, conn, reusable=True):
+        """归还连接；响应未读完或出错的连接直接关闭"""
+        if not reusable:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ClaudeBackend:
+    """Claude Messages API 客户端"""
+
+    def __init__(self, api_key, base_url='https://api.anthropic.com', model='claude-sonnet-4-5',
+                 max_tokens=2048, timeout=60, deadline=120, pool_size=8, rate_limit=5, burst=None,
+                 max_retries=3, backoff_base=0.5, backoff_max=8, breaker_threshold=5, breaker_reset=30):
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool = ConnectionPool(base_url, size=pool_size, timeout=timeout)
+        self.limiter = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+
+    def _backoff(self, attempt, retry_after=None):
+        """第 attempt 次重试前的等待时间（full jitter）"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _payload(self, images, prompt, stream):
+        content = [
+            {'type': 'image', 'source': {'type': 'base64', 'media_type': media_type, 'data': data}}
+            for media_type, data in images
+        ]
+        content.append({'type': 'text', 'text': prompt})
+        return json.dumps({
+            'model': self.model,
+            'max_tokens': self.max_tokens,
+            'stream': stream,
+            'messages': [{'role': 'user', 'content': content}]
+        }).encode('utf-8')
+
+    @staticmethod
+    def _error_from_response(resp):
+        body = resp.read()
+        try:
+            message = json.loads(body)['error']['message']
+        except (ValueError, KeyError, TypeError):
+            message = body[:200].decode('utf-8', 'replace')
+        retry_after = resp.getheader('Retry-After')
+        try:
+            retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            retry_after = None
+        return BackendError(
+            f'模型接口返回 {resp.status}: {message}', status=resp.status,
+            retryable=resp.status in RETRY_STATUSES, retry_after=retry_after
+        )
+
+    @staticmethod
+    def _read_stream(resp, on_delta, check_deadline):
+        """解析 SSE 流，逐段回调增量文本，返回完整文本"""
+        parts = []
+        event = None
+        for raw in resp:
+            check_deadline()
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data = json.loads(line[5:])
+                if event == 'content_block_delta' and data['delta'].get('type') == 'text_delta':
+                    text = data['delta']['text']
+                    parts.append(text)
+                    on_delta(text)
+                elif event == 'error':
+                    raise BackendError(f"模型接口错误: {data['error']['message']}", retryable=True)
+                elif event == 'message_stop':
+                    break
+        return ''.join(parts)
+
+    def _limit_timeout(self, conn, deadline):
+        """读取超时不超过距总时限的剩余时间；已超过总时限时抛出 BackendError"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise BackendError('模型响应超过总时限', retryable=True)
+        if conn.sock is not None:
+            conn.sock.settimeout(min(self.pool.timeout, remaining))
+
+    def _send(self, body, deadline):
+        """发送请求，返回 (连接, 响应)；空闲连接已被服务端关闭时换新连接重发一次"""
+        headers = {
+            'content-type': 'application/json',
+            'x-api-key': self.api_key,
+            'anthropic-version': API_VERSION
+        }
+        conn, reused = self.pool.acquire()
+        try:
+            self._limit_timeout(conn, deadline)
+            conn.request('POST', self.pool.base_path + '/v1/messages', body=body, headers=headers)
+            return conn, conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+        except BaseException:
+            conn.close()
+            raise
+
+        conn = self.pool.new_connection()
+        try:
+            self._limit_timeout(conn, deadline)
+            conn.request('POST', self.pool.base_path + '/v1/messages', body=body, headers=headers)
+            return conn, conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def _read_body(self, conn, resp, deadline):
+        """分块读取完整响应体，每块之间检查总时限"""
+        chunks = []
+        while True:
+            self._limit_timeout(conn, deadline)
+            chunk = resp.read1(64 * 1024)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def _call(self, body, on_delta, deadline):
+        conn, resp = self._send(body, deadline)
+        reusable = False
+        try:
+            if resp.status != 200:
+                error = self._error_from_response(resp)
+                reusable = not resp.will_close
+                raise error
+
+            try:
+                if on_delta is None:
+                    data = json.loads(self._read_body(conn, resp, deadline))
+                    text = ''.join(block.get('text', '') for block in data['content'] if block['type'] == 'text')
+                else:
+                    text = self._read_stream(resp, on_delta, lambda: self._limit_timeout(conn, deadline))
+                    # 提前结束时丢弃剩余数据，连接状态不确定则不复用
+                    resp.read()
+            except (ValueError, KeyError, TypeError) as e:
+                raise BackendError(f'模型接口返回的数据无法解析: {e!r}', retryable=True)
+            reusable = not resp.will_close
+            return text
+        finally:
+            self.pool.release(conn, reusable)
+
+    def analyze(self, images, prompt, on_delta=None):
+        """发送图片和提示词，返回模型输出文本
+
+        images 为 (media_type, base64 数据) 列表；传入 on_delta 时使用流式输出。
+        流式输出已经开始后出错不再重试，避免重复的增量文本。
+        """
+        started = time.monotonic()
+        body = self._payload(images, prompt, stream=on_delta is not None)
+        emitted = False
+
+        def forward(text):
+            nonlocal emitted
+            emitted = True
+            on_delta(text)
+
+        attempt = 0
+        while True:
+            token = self.breaker.allow()
+            if token is None:
+                raise BackendError('模型服务暂时不可用，请稍后再试', status=503)
+            remaining = self.deadline - (time.monotonic() - started)
+            if self.limiter is not None and not self.limiter.acquire(timeout=max(0, remaining)):
+                self.breaker.release(token)
+                raise BackendError('模型请求排队超时，请稍后再试', status=429)
+
+            try:
+                text = self._call(body, forward if on_delta else None, started + self.deadline)
+            except BackendError as e:
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                error = BackendError(f'模型接口连接失败: {e}', retryable=True)
+            except BaseException:
+                # 其它异常同样计为失败，否则半开状态的试探永远不会结束
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return text
+
+            if error.retryable or error.status is None:
+                self.breaker.record_failure()
+            else:
+                # 4xx 属于请求本身的问题，不代表上游不可用
+                self.breaker.record_success()
+
+            delay = self._backoff(attempt, error.retry_after)
+            elapsed = time.monotonic() - started
+            if (not error.retryable or emitted or attempt >= self.max_retries
+                    or elapsed + delay >= self.deadline):
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        return {
+            'model': self.model,
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'idle_connections': self.pool.idle
+        }
@@ -0,0 +1,267 @@
+"""按请求采样的性能分析
+
+开启后（PROFILE_ENABLED=1），以下请求会被完整记录：
+- 带 X-Profile: 1 请求头或 ?profile=1 参数的请求（设置了 PROFILE_TOKEN 时需一致）
+- 分析接口按 PROFILE_SAMPLE_RATE 随机抽样的请求
+
+两种记录方式：
+- cprofile：cProfile 记录请求线程以及为该请求执行分析的线程池线程，合并后保存为 .pstats
+  （可用 `python -m pstats`、snakeviz 打开）
+- sample：后台线程定期采集相关线程的调用栈，保存为折叠栈格式 .collapsed
+  （可直接交给 flamegraph.pl 或 speedscope 生成火焰图）
+
+流式接口和异步任务的分析在请求线程返回响应之后才在后台线程中执行：
+这些线程通过 bind_background 纳入记录，记录等它们结束后再保存。
+
+关闭时不注册任何钩子，没有额外开销。
+"""
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+
+MODES = {'cprofile': '.pstats', 'sample': '.collapsed'}
+
+_current = contextvars.ContextVar('profile_session', default=None)
+
+
+class ProfileSession:
+    """一次请求的性能记录"""
+
+    def __init__(self, mode='cprofile', interval=0.005):
+        if mode not in MODES:
+            raise ValueError(f'不支持的记录方式: {mode}')
+        self.mode = mode
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.duration = None
+        self._profiles = []
+        self._threads = set()
+        self._samples = Counter()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._active = 0
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._main_profile = None
+        self._main_thread = None
+
+    def start(self):
+        """开始记录当前（请求）线程"""
+        if self.mode == 'cprofile':
+            self._main_profile = self._new_profile()
+            self._main_profile.enable()
+        else:
+            self._main_thread = threading.get_ident()
+            self._threads.add(self._main_thread)
+            self._sampler = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+            self._sampler.start()
+
+    def stop_main(self):
+        """停止记录请求线程（需在请求线程中调用），后台线程继续记录"""
+        if self._main_profile is not None:
+            self._main_profile.disable()
+        with self._lock:
+            self._threads.discard(self._main_thread)
+
+    def hold(self):
+        """登记一项属于本次请求、尚未结束的后台工作"""
+        with self._lock:
+            self._active += 1
+
+    def release(self):
+        with self._idle:
+            self._active -= 1
+            self._idle.notify_all()
+
+    @property
+    def busy(self):
+        with self._lock:
+            return self._active > 0
+
+    def stop(self, wait=0):
+        """结束记录；wait 为等待后台工作结束的最长时间（秒）"""
+        if wait:
+            with self._idle:
+                self._idle.wait_for(lambda: self._active == 0, wait)
+        self.duration = time.perf_counter() - self.started
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _new_profile(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def run(self, fn, *args, **kwargs):
+        """在其它线程中执行属于本次请求的工作，并纳入记录"""
+        if self._stopped.is_set():
+            return fn(*args, **kwargs)
+        self.hold()
+        try:
+            if self.mode == 'cprofile':
+                profile = self._new_profile()
+                profile.enable()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    profile.disable()
+
+            ident = threading.get_ident()
+            with self._lock:
+                self._threads.add(ident)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._threads.discard(ident)
+        finally:
+            self.release()
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self._samples[self._collapse(frame)] += 1
+
+    def dump(self, path):
+        if self.mode == 'cprofile':
+            stats = pstats.Stats(self._profiles[0])
+            for profile in self._profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in self._samples.most_common():
+                    f.write(f'{stack} {count}\n')
+
+
+class RequestProfiler:
+    """管理请求级性能记录的保存与读取"""
+
+    def __init__(self, folder, mode='cprofile', interval=0.005, keep=50):
+        if mode not in MODES:
+            raise ValueError(f'不支持的记录方式: {mode}')
+        self.folder = folder
+        self.mode = mode
+        self.interval = interval
+        self.keep = keep
+        os.makedirs(folder, exist_ok=True)
+
+    def begin(self, mode=None):
+        """开始记录当前请求，返回 (会话, contextvar 令牌)"""
+        session = ProfileSession(mode or self.mode, self.interval)
+        token = _current.set(session)
+        session.start()
+        return session, token
+
+    @staticmethod
+    def new_id():
+        return f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def detach(session, token):
+        """请求线程的工作结束（在请求线程中调用）：停止记录请求线程，后台工作仍继续记录"""
+        session.stop_main()
+        _current.reset(token)
+
+    def finish(self, session, token, meta):
+        """结束记录并保存，返回记录 id"""
+        self.detach(session, token)
+        return self.save(session, meta)
+
+    def save(self, session, meta, profile_id=None, wait=0):
+        """保存记录，返回记录 id；wait 为等待后台工作结束的最长时间（秒）"""
+        session.stop(wait)
+        profile_id = profile_id or self.new_id()
+        session.dump(os.path.join(self.folder, profile_id + MODES[session.mode]))
+        meta = dict(meta, id=profile_id, mode=session.mode, duration_ms=round(session.duration * 1000, 2),
+                    created_at=datetime.now().isoformat())
+        with open(os.path.join(self.folder, profile_id + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._prune()
+        return profile_id
+
+    @staticmethod
+    def bind(fn):
+        """当前请求正在记录时，返回会在记录中执行 fn 的包装（用于提交到线程池）"""
+        session = _current.get()
+        if session is None:
+            return fn
+        return lambda *args, **kwargs: session.run(fn, *args, **kwargs)
+
+    @staticmethod
+    def bind_background(fn):
+        """返回在新线程或任务队列中为当前请求执行 fn 的包装
+
+        复制当前的 contextvars，fn 内提交到线程池的工作仍能找到记录会话；
+        当前请求正在记录时，记录会等 fn 结束后再保存。
+        """
+        ctx = contextvars.copy_context()
+        session = _current.get()
+        if session is None:
+            return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+        session.hold()
+
+        def run(*args, **kwargs):
+            try:
+                return ctx.run(session.run, fn, *args, **kwargs)
+            finally:
+                session.release()
+        return run
+
+    def _prune(self):
+        metas = sorted(name for name in os.listdir(self.folder) if name.endswith('.json'))
+        for name in metas[:max(0, len(metas) - self.keep)]:
+            profile_id = name[:-5]
+            for ext in ('.json', *MODES.values()):
+                try:
+                    os.remove(os.path.join(self.folder, profile_id + ext))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """已保存的记录（新的在前）"""
+        result = []
+        for name in sorted(os.listdir(self.folder), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.folder, name), 'r', encoding='utf-8') as f:
+                        result.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return result
+
+    def path_of(self, profile_id):
+        """记录文件路径，不存在返回 None"""
+        if not profile_id.replace('_', '').isalnum():
+            return None
+        for ext in MODES.values():
+            path = os.path.join(self.folder, profile_id + ext)
+            if os.path.exists(path):
+                return path
+        return None
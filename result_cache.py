@@ -0,0 +1,155 @@
+"""分析结果缓存
+
+相同图片（按内容哈希）+ 风格 + 补充说明 + 模板的分析结果直接复用，
+避免重复调用模型。支持两种后端：
+- memory：进程内 LRU
+- disk：SQLite 文件，gunicorn worker 重启后仍然有效，多个 worker 共享
+两种后端都按 TTL 过期、按条目数淘汰最久未使用的结果。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(image_digests, style_key, user_context='', custom_template='', backend=''):
+    """根据图片内容哈希、分析参数和生成结果的后端（模型与参数）生成缓存键"""
+    payload = json.dumps(
+        [list(image_digests), style_key, user_context or '', custom_template or '', backend or ''],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    """进程内 LRU 缓存"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def size(self):
+        with self._lock:
+            return len(self._data)
+
+
+class DiskBackend:
+    """SQLite 文件缓存，可在多个进程间共享"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS result_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_result_cache_expires ON result_cache(expires_at);
+    CREATE INDEX IF NOT EXISTS idx_result_cache_accessed ON result_cache(accessed_at);
+    """
+
+    def __init__(self, db_path, max_entries=10000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT value, expires_at FROM result_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        with conn:
+            if row[1] < now:
+                conn.execute('DELETE FROM result_cache WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE result_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO result_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now + ttl, now)
+            )
+            conn.execute('DELETE FROM result_cache WHERE expires_at < ?', (now,))
+            overflow = conn.execute('SELECT COUNT(*) FROM result_cache').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    'DELETE FROM result_cache WHERE key IN '
+                    '(SELECT key FROM result_cache ORDER BY accessed_at LIMIT ?)',
+                    (overflow,)
+                )
+
+    def size(self):
+        return self._conn().execute('SELECT COUNT(*) FROM result_cache').fetchone()[0]
+
+
+class ResultCache:
+    """分析结果缓存，记录命中/未命中次数（按进程统计）"""
+
+    def __init__(self, backend, ttl=24 * 3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': self.backend.size(),
+            'ttl': self.ttl
+        }
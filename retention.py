@@ -0,0 +1,229 @@
+"""数据保留策略 - 历史归档、上传图片回收与存储整理
+
+- 归档：超过保留天数、或超出在线记录数上限的旧记录写入 gzip 压缩的
+  JSONL 分段文件（data/archive/），并移出在线存储；归档记录仍可按 id 读取
+- 清理分段：已删除的归档记录从分段中移除，不再有任何记录的分段直接删除
+- 回收：按引用计数删除没有任何记录（含已归档记录）引用的上传图片，
+  以及原图已删除的预处理派生图片；新上传的文件有宽限期，避免误删进行中的分析
+- 整理：合并全文索引、截断 WAL，可选 VACUUM
+
+通过后台线程定期运行，或命令行 `python app.py retention` 手动运行；
+文件读写按 io_bytes_per_sec 限速，避免影响在线请求。
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from image_store import DIGEST_PATTERN
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """简单的字节速率限制：累计字节超出速率时休眠"""
+
+    def __init__(self, bytes_per_sec):
+        self.bytes_per_sec = bytes_per_sec
+        self._started = time.monotonic()
+        self._consumed = 0
+
+    def consume(self, nbytes):
+        if not self.bytes_per_sec:
+            return
+        self._consumed += nbytes
+        expected = self._consumed / self.bytes_per_sec
+        elapsed = time.monotonic() - self._started
+        if expected > elapsed:
+            time.sleep(expected - elapsed)
+
+
+class RetentionManager:
+    """执行保留策略"""
+
+    def __init__(self, store, upload_folder, archive_folder, retention_days=0, max_records=0,
+                 upload_grace=3600, io_bytes_per_sec=5 * 1024 * 1024, segment_size=1000):
+        self.store = store
+        self.upload_folder = upload_folder
+        self.archive_folder = archive_folder
+        self.retention_days = retention_days
+        self.max_records = max_records
+        self.upload_grace = upload_grace
+        self.io_bytes_per_sec = io_bytes_per_sec
+        self.segment_size = segment_size
+        self._thread = None
+        os.makedirs(archive_folder, exist_ok=True)
+
+    def _write_segment(self, records, limiter):
+        """把一批记录写成一个压缩分段，返回分段文件名"""
+        name = f"history-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}-{len(records)}.jsonl.gz"
+        path = os.path.join(self.archive_folder, name)
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for record in records:
+                line = json.dumps(record, ensure_ascii=False) + '\n'
+                f.write(line)
+                limiter.consume(len(line))
+        os.replace(tmp_path, path)
+        return name
+
+    def archive(self, limiter, dry_run=False):
+        """按天数和记录数上限归档旧记录，返回归档条数"""
+        archived = 0
+        cutoff = None
+        if self.retention_days:
+            cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+
+        while True:
+            batch = []
+            if cutoff:
+                batch = self.store.oldest_records(self.segment_size, before=cutoff)
+            if not batch and self.max_records:
+                excess = self.store.count() - self.max_records
+                if excess > 0:
+                    batch = self.store.oldest_records(min(excess, self.segment_size))
+            if not batch:
+                return archived
+
+            if dry_run:
+                return archived + len(batch)
+            segment = self._write_segment(batch, limiter)
+            self.store.archive_records(batch, segment)
+            archived += len(batch)
+
+    def purge_segments(self, limiter, dry_run=False):
+        """从归档分段中移除已删除的记录，返回 (移除记录数, 删除分段数)
+
+        分段先写文件再登记到数据库，新写入的分段有宽限期，避免误删进行中的归档。
+        """
+        live = self.store.archive_segments()
+        deadline = time.time() - self.upload_grace
+        purged, dropped = 0, 0
+
+        # 先列出再处理，重写分段时会在同一目录下创建临时文件
+        with os.scandir(self.archive_folder) as it:
+            entries = [entry for entry in it if entry.is_file() and entry.name.endswith('.jsonl.gz')]
+        for entry in entries:
+            if entry.stat().st_mtime > deadline:
+                continue
+            path = os.path.join(self.archive_folder, entry.name)
+            ids = live.get(entry.name, set())
+            kept, removed = [], 0
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    limiter.consume(len(line))
+                    if json.loads(line)['id'] in ids:
+                        kept.append(line)
+                    else:
+                        removed += 1
+            if not removed:
+                continue
+            purged += removed
+            if not kept:
+                dropped += 1
+            if dry_run:
+                continue
+            if not kept:
+                os.remove(path)
+                continue
+            # 原名原子替换，数据库中记录所在的分段不变，读取中的文件不受影响
+            tmp_path = path + '.tmp'
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                for line in kept:
+                    f.write(line)
+                    limiter.consume(len(line))
+            os.replace(tmp_path, path)
+        return purged, dropped
+
+    def read_archived(self, record_id):
+        """从归档分段中读取记录，未归档返回 None"""
+        segment = self.store.archived_segment(record_id)
+        if segment is None:
+            return None
+        with gzip.open(os.path.join(self.archive_folder, segment), 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['id'] == record_id:
+                    record['archived'] = True
+                    return record
+        return None
+
+    def collect_uploads(self, limiter, dry_run=False):
+        """删除没有被引用的上传图片，返回 (删除文件数, 释放字节数)"""
+        refs = self.store.image_ref_counts()
+        deadline = time.time() - self.upload_grace
+        removed, freed = [], 0
+        live_digests = set()
+
+        with os.scandir(self.upload_folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                path = os.path.join(self.upload_folder, entry.name)
+                stat = entry.stat()
+                if path in refs or stat.st_mtime > deadline:
+                    live_digests.add(entry.name.split('.')[0])
+                    continue
+                removed.append(path)
+                freed += stat.st_size
+
+        # 原图已删除（或不再保留）的预处理派生图片
+        derived_folder = os.path.join(self.upload_folder, 'derived')
+        if os.path.isdir(derived_folder):
+            with os.scandir(derived_folder) as entries:
+                for entry in entries:
+                    stem = entry.name.split('.')[0]
+                    if not entry.is_file() or not DIGEST_PATTERN.match(stem):
+                        continue
+                    if stem[:64] not in live_digests and entry.stat().st_mtime <= deadline:
+                        removed.append(os.path.join(derived_folder, entry.name))
+                        freed += entry.stat().st_size
+
+        if dry_run:
+            return len(removed), freed
+
+        for path in removed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            limiter.consume(4096)
+        self.store.drop_image_refs(removed)
+        return len(removed), freed
+
+    def run(self, dry_run=False, vacuum=False):
+        """执行一次完整的保留策略，返回统计信息"""
+        limiter = RateLimiter(self.io_bytes_per_sec)
+        started = time.monotonic()
+        archived = self.archive(limiter, dry_run)
+        purged, dropped = self.purge_segments(limiter, dry_run)
+        removed, freed = self.collect_uploads(limiter, dry_run)
+        if not dry_run:
+            self.store.compact(vacuum=vacuum)
+        return {
+            'archived_records': archived,
+            'purged_records': purged,
+            'removed_segments': dropped,
+            'removed_files': removed,
+            'freed_bytes': freed,
+            'dry_run': dry_run,
+            'seconds': round(time.monotonic() - started, 3)
+        }
+
+    def start(self, interval):
+        """启动后台线程，每 interval 秒运行一次（多个进程间只有一个会执行）"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self.store.claim_maintenance('retention', interval):
+                        logger.info('保留策略执行完成: %s', self.run())
+                except Exception:
+                    logger.exception('保留策略执行失败')
+
+        self._thread = threading.Thread(target=loop, name='retention', daemon=True)
+        self._thread.start()
@@ -0,0 +1,75 @@
+"""历史记录全文检索 - 分词与查询构造
+
+索引使用 SQLite FTS5（见 history_store.py），分词在这里完成：
+- 中日韩文字按相邻两字切分（“留存率” → “留存 存率”），单字成词
+- 英文、数字按单词切分并转为小写（“QPS” → “qps”）
+分词结果以空格连接后写入 FTS5，查询时用同样的规则切分并构造短语查询，
+因此“留存率”只匹配连续出现的三个字。
+
+单个汉字按前缀匹配两字词，但词尾的字不是任何两字词的开头（“周报”中的“报”），
+因此写入索引时在每列末尾追加各段中文的最后一个字。
+"""
+import re
+
+
+CJK_PATTERN = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_PATTERN = re.compile(rf'([{CJK_PATTERN}]+)|([0-9a-z]+)')
+FIELD_COLUMNS = ('name', 'user_context', 'body')
+
+# 索引的分词规则变化时加一，已有索引按新规则重建
+INDEX_VERSION = 2
+
+
+def tokenize(text):
+    """把文本切分为检索词列表"""
+    tokens = []
+    for cjk, word in TOKEN_PATTERN.findall((text or '').lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+def index_tokens(text):
+    """写入索引的检索词：分词结果 + 各段中文的最后一个字（放在末尾，不影响短语匹配）"""
+    tails = dict.fromkeys(cjk[-1] for cjk, _ in TOKEN_PATTERN.findall((text or '').lower()) if len(cjk) > 1)
+    return tokenize(text) + list(tails)
+
+
+def document_fields(name, user_context, analyses):
+    """把一条历史记录转换为 FTS5 各列的分词文本"""
+    body = '\n'.join(f"{a.get('style', '')}\n{a.get('analysis', '')}" for a in analyses)
+    return tuple(' '.join(index_tokens(text)) for text in (name, user_context, body))
+
+
+def build_match_query(query):
+    """把用户输入转换为 FTS5 MATCH 表达式，没有可检索内容时返回 None
+
+    空格分隔的多个词之间为 AND 关系；单个汉字按前缀匹配。
+    """
+    phrases = []
+    for term in query.split():
+        tokens = tokenize(term)
+        if not tokens:
+            continue
+        if len(tokens) == 1 and len(tokens[0]) == 1 and not tokens[0].isascii():
+            phrases.append(f'{tokens[0]}*')
+        else:
+            phrases.append('"' + ' '.join(tokens) + '"')
+    return ' AND '.join(phrases) if phrases else None
+
+
+def make_snippet(text, query, width=40):
+    """在原文中截取第一个命中词附近的片段"""
+    lowered = text.lower()
+    positions = [lowered.find(term.lower()) for term in query.split()]
+    positions = [p for p in positions if p >= 0]
+    if not positions:
+        return text[:width * 2].replace('\n', ' ')
+
+    start = max(0, min(positions) - width)
+    snippet = text[start:start + width * 2].replace('\n', ' ')
+    return ('…' if start > 0 else '') + snippet + ('…' if start + width * 2 < len(text) else '')
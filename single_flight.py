@@ -0,0 +1,197 @@
+"""相同分析请求合并（single-flight）
+
+多人同时分析同一组图片、同一风格时，只有第一个请求真正调用模型，
+其余请求等待并共享同一个结果：
+- 进程内：按键登记正在进行的计算，后来者等待其完成；流式输出的增量文本
+  会同时转发给所有等待者（后加入的先补发已有内容）
+- 跨 gunicorn worker：在共享锁文件上按键的哈希对一个字节加 POSIX 记录锁，
+  持锁的 worker 负责计算并把结果写到 <键>.json；其它 worker 等锁释放后读取结果，
+  结果不存在（计算方出错或崩溃）时自行计算
+不支持 fcntl 的平台（Windows）只做进程内合并。
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows 没有 fcntl，跳过跨进程合并
+    fcntl = None
+
+
+# 锁文件中可用的字节范围，不同键映射到同一字节的概率可忽略
+LOCK_RANGE = 2 ** 31
+POLL_INTERVAL = 0.05
+
+
+class _Call:
+    """一次进行中的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.chunks = []
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def emit(self, text):
+        with self.lock:
+            self.chunks.append(text)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(text)
+
+    def subscribe(self, on_delta):
+        with self.lock:
+            for text in self.chunks:
+                on_delta(text)
+            self.listeners.append(on_delta)
+
+
+class SingleFlight:
+    """按键合并并发的相同计算"""
+
+    def __init__(self, lock_dir=None, wait_timeout=300, result_ttl=60):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._lock_fd = None
+        self._last_sweep = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.coalesced_remote = 0
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _lock_file(self):
+        # 记录锁属于进程，关闭该文件的任意描述符都会释放本进程的全部锁，
+        # 因此每个进程只打开一次且不关闭
+        if self._lock_fd is None or self._lock_fd[0] != os.getpid():
+            fd = os.open(os.path.join(self.lock_dir, 'inflight.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            self._lock_fd = (os.getpid(), fd)
+        return self._lock_fd[1]
+
+    def _result_path(self, key):
+        return os.path.join(self.lock_dir, f'{key}.json')
+
+    def _try_lock(self, key):
+        offset = int(key[:16], 16) % LOCK_RANGE
+        try:
+            fcntl.lockf(self._lock_file(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+            return offset
+        except OSError:
+            return None
+
+    def _unlock(self, offset):
+        fcntl.lockf(self._lock_file(), fcntl.LOCK_UN, 1, offset)
+
+    def _publish(self, key, result):
+        """把结果写给其它 worker，顺便清理过期结果文件"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir, prefix='.result_')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, self._result_path(key))
+
+        now = time.time()
+        if now - self._last_sweep < self.result_ttl:
+            return
+        self._last_sweep = now
+        with os.scandir(self.lock_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and now - entry.stat().st_mtime > self.result_ttl:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def _run_across_workers(self, key, fn):
+        """跨进程合并，返回 (结果, 是否来自其它 worker)"""
+        waited_since = None
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            offset = self._try_lock(key)
+            if offset is not None:
+                if waited_since is not None:
+                    # 等到了锁：其它 worker 刚完成同一计算，结果文件比开始等待的时间新
+                    try:
+                        path = self._result_path(key)
+                        if os.path.getmtime(path) >= waited_since:
+                            with open(path, 'r', encoding='utf-8') as f:
+                                result = json.load(f)
+                            self._unlock(offset)
+                            return result, True
+                    except (OSError, ValueError):
+                        pass
+                try:
+                    result = fn()
+                    self._publish(key, result)
+                    return result, False
+                finally:
+                    self._unlock(offset)
+
+            if waited_since is None:
+                waited_since = time.time()
+            if time.monotonic() > deadline:
+                # 对方卡住时不再等待，自行计算
+                return fn(), False
+            time.sleep(POLL_INTERVAL)
+
+    def do(self, key, fn, on_delta=None):
+        """执行 fn(on_delta)，相同 key 的并发调用共享结果
+
+        返回 (结果, 是否共享了其它调用的结果)；fn 抛出的异常同样传给所有等待者。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if on_delta is not None:
+                call.subscribe(on_delta)
+            call.done.wait()
+            with self._lock:
+                self.coalesced += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        # 发起者需要流式输出时才转发增量文本，后加入的等待者共享转发
+        emit = None
+        if on_delta is not None:
+            call.subscribe(on_delta)
+            emit = call.emit
+        try:
+            if self.lock_dir:
+                call.result, remote = self._run_across_workers(key, lambda: fn(emit))
+            else:
+                call.result, remote = fn(emit), False
+            with self._lock:
+                if remote:
+                    self.coalesced_remote += 1
+                else:
+                    self.executed += 1
+            return call.result, remote
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'coalesced_across_workers': self.coalesced_remote,
+                'in_flight': len(self._calls),
+                'across_workers': self.lock_dir is not None
+            }
@@ -1,11 +1,20 @@
 // 全局变量
 let selectedFiles = [];
+let historyCursor = null;
+let historyQuery = '';
+let historySearchOffset = null;
+const HISTORY_PAGE_SIZE = 50;
+// 历史记录本地缓存：已加载的摘要、翻页游标和对应的数据版本，增量同步时只获取变化的部分
+const HISTORY_CACHE_KEY = 'historyCache';
+let historyCache = null;
 let currentTemplateType = 'daily';
 let templates = {
     daily: '',
     weekly: '',
     monthly: ''
 };
+// 服务端保存的模板 id，分析时只发送 id
+let templateIds = {};
 
 // 页面加载完成后初始化
 document.addEventListener('DOMContentLoaded', function() {
@@ -21,8 +30,14 @@ async function initializeApp() {
     // 绑定粘贴区域事件
     setupPasteArea();
 
-    // 加载历史记录
-    loadHistory();
+    // 加载历史记录：先显示本地缓存，再增量同步
+    historyCache = readHistoryCache();
+    if (historyCache) {
+        renderHistoryCache();
+        syncHistory();
+    } else {
+        loadHistory();
+    }
 }
 
 // 切换标签页
@@ -223,34 +238,63 @@ async function startAnalyze() {
     formData.append('context', document.getElementById('userContext').value);
     formData.append('name', document.getElementById('saveName').value);
 
-    // 添加模板信息
-    formats.forEach(format => {
-        if (templates[format]) {
-            formData.append(`template_${format}`, templates[format]);
-        }
-    });
+    // 添加模板信息：已保存到服务端的模板只发送 id，sendContent 时发送模板内容
+    const buildForm = sendContent => {
+        const form = new FormData();
+        for (const [key, value] of formData.entries()) form.append(key, value);
+        formats.forEach(format => {
+            if (templateIds[format] && !sendContent) {
+                form.append(`template_id_${format}`, templateIds[format]);
+            } else if (templates[format]) {
+                form.append(`template_${format}`, templates[format]);
+            }
+        });
+        return form;
+    };
 
-    // 显示加载提示
+    // 显示加载提示，收到第一个事件后切换为逐个渲染结果
     showLoading(true);
 
     try {
-        const response = await fetch('/api/analyze', {
+        let response = await fetch('/api/analyze/stream', {
             method: 'POST',
-            body: formData
+            body: buildForm(false)
         });
 
-        const data = await response.json();
+        if (response.status === 400 && Object.keys(templateIds).length) {
+            // 模板 id 已被删除：改为发送模板内容，并重新为本地模板取得 id
+            const data = await response.clone().json();
+            if (data.code === 'template_not_found') {
+                templateIds = {};
+                response = await fetch('/api/analyze/stream', {
+                    method: 'POST',
+                    body: buildForm(true)
+                });
+                syncTemplateIds();
+            }
+        }
 
-        if (data.error) {
-            alert('分析失败: ' + data.error);
+        if (!response.ok) {
+            const data = await response.json();
+            alert('分析失败: ' + (data.error || response.status));
             return;
         }
 
-        // 显示结果
-        displayResults(data.analyses);
-
-        // 刷新历史记录
-        loadHistory();
+        await readEventStream(response, (event, data) => {
+            if (event === 'start') {
+                showLoading(false);
+                prepareResultCards(data.styles);
+            } else if (event === 'delta') {
+                appendAnalysisDelta(data.index, data.text);
+            } else if (event === 'result') {
+                renderAnalysisCard(data.index, data);
+            } else if (event === 'error') {
+                alert('分析失败: ' + data.error);
+            } else if (event === 'done') {
+                // 刷新历史记录
+                syncHistory();
+            }
+        });
 
     } catch (error) {
         console.error('分析失败:', error);
@@ -260,6 +304,93 @@ async function startAnalyze() {
     }
 }
 
+// 读取 Server-Sent Events 响应流，逐个事件回调
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+// 流式分析：按风格预先创建结果卡片
+let streamingTexts = [];
+
+function prepareResultCards(styles) {
+    const resultSection = document.getElementById('resultSection');
+    const resultContent = document.getElementById('resultContent');
+
+    resultContent.innerHTML = '';
+    streamingTexts = styles.map(() => '');
+
+    styles.forEach((style, index) => {
+        const card = document.createElement('div');
+        card.className = 'analysis-card';
+        card.innerHTML = `
+            <div class="analysis-header">
+                <div class="analysis-title">${style.name}</div>
+                <button class="btn-copy" onclick="copyAnalysis(${index})">
+                    <i class="fas fa-copy"></i> 复制
+                </button>
+            </div>
+            <div class="analysis-content" id="analysis_${index}">
+                <p class="analysis-pending"><i class="fas fa-spinner fa-spin"></i> 正在分析中...</p>
+            </div>
+        `;
+        resultContent.appendChild(card);
+    });
+
+    resultSection.style.display = 'block';
+    resultSection.scrollIntoView({ behavior: 'smooth' });
+}
+
+// 增量文本每帧最多重新解析一次，避免长报告逐段全文重解析
+let pendingDeltaFrame = null;
+const dirtyCards = new Set();
+
+function appendAnalysisDelta(index, text) {
+    streamingTexts[index] += text;
+    dirtyCards.add(index);
+    if (pendingDeltaFrame === null) {
+        pendingDeltaFrame = requestAnimationFrame(() => {
+            pendingDeltaFrame = null;
+            dirtyCards.forEach(i => {
+                document.getElementById(`analysis_${i}`).innerHTML = marked.parse(streamingTexts[i]);
+            });
+            dirtyCards.clear();
+        });
+    }
+}
+
+// 优先使用服务端渲染好的 HTML，旧数据没有时在前端解析
+function analysisHTML(analysis) {
+    return analysis.html || marked.parse(analysis.analysis);
+}
+
+function renderAnalysisCard(index, analysis) {
+    streamingTexts[index] = analysis.analysis;
+    dirtyCards.delete(index);
+    document.getElementById(`analysis_${index}`).innerHTML = analysisHTML(analysis);
+}
+
 // 显示结果
 function displayResults(analyses) {
     const resultSection = document.getElementById('resultSection');
@@ -278,7 +409,7 @@ function displayResults(analyses) {
                 </button>
             </div>
             <div class="analysis-content" id="analysis_${index}">
-                ${marked.parse(analysis.analysis)}
+                ${analysisHTML(analysis)}
             </div>
         `;
         resultContent.appendChild(card);
@@ -325,27 +456,157 @@ function toggleHistory() {
     sidebar.classList.toggle('open');
 }
 
-// 加载历史记录
+// 加载历史记录（第一页）
 async function loadHistory() {
+    if (historyQuery) {
+        searchHistory(historyQuery);
+        return;
+    }
+
+    historyCursor = null;
+    try {
+        const response = await fetch(`/api/history?limit=${HISTORY_PAGE_SIZE}`);
+        const data = await response.json();
+        historyCursor = data.next_cursor;
+        historyCache = { version: data.version, items: data.history, cursor: historyCursor };
+        saveHistoryCache();
+        displayHistory(data.history, false, !!historyCursor);
+    } catch (error) {
+        console.error('加载历史记录失败:', error);
+    }
+}
+
+function readHistoryCache() {
+    try {
+        const cache = JSON.parse(localStorage.getItem(HISTORY_CACHE_KEY));
+        return cache && Number.isInteger(cache.version) && Array.isArray(cache.items) ? cache : null;
+    } catch (error) {
+        return null;
+    }
+}
+
+function saveHistoryCache() {
+    try {
+        localStorage.setItem(HISTORY_CACHE_KEY, JSON.stringify(historyCache));
+    } catch (error) {
+        // 存储空间不足时只保留内存中的缓存
+    }
+}
+
+function renderHistoryCache() {
+    historyCursor = historyCache.cursor;
+    displayHistory(historyCache.items, false, !!historyCursor);
+}
+
+// 把一条变更应用到本地缓存
+function applyHistoryChange(change) {
+    const items = historyCache.items;
+    const id = change.op === 'upsert' ? change.record.id : change.id;
+    const index = items.findIndex(item => item.id === id);
+    if (index !== -1) items.splice(index, 1);
+    if (change.op !== 'upsert') return;
+
+    const record = change.record;
+    // 早于已加载范围的记录留到"加载更多"时再获取
+    const last = items[items.length - 1];
+    if (historyCache.cursor && last && record.timestamp < last.timestamp) return;
+    const position = items.findIndex(item => item.timestamp < record.timestamp);
+    items.splice(position === -1 ? items.length : position, 0, record);
+}
+
+// 增量同步历史记录：只获取上次同步之后的新增、重命名和删除
+async function syncHistory() {
+    if (historyQuery) {
+        searchHistory(historyQuery);
+        return;
+    }
+    if (!historyCache) {
+        loadHistory();
+        return;
+    }
+
     try {
-        const response = await fetch('/api/history');
+        let changed = false;
+        let hasMore = true;
+        while (hasMore) {
+            const response = await fetch(`/api/history/changes?since=${historyCache.version}`);
+            const data = await response.json();
+            if (data.reset) {
+                loadHistory();
+                return;
+            }
+            data.changes.forEach(applyHistoryChange);
+            changed = changed || data.changes.length > 0 || data.version !== historyCache.version;
+            historyCache.version = data.version;
+            hasMore = data.has_more;
+        }
+        if (changed) {
+            saveHistoryCache();
+            renderHistoryCache();
+        }
+    } catch (error) {
+        console.error('同步历史记录失败:', error);
+    }
+}
+
+// 加载更多历史记录
+async function loadMoreHistory() {
+    if (historyQuery) {
+        searchHistory(historyQuery, historySearchOffset);
+        return;
+    }
+    if (!historyCursor) return;
+
+    try {
+        const response = await fetch(`/api/history?limit=${HISTORY_PAGE_SIZE}&cursor=${encodeURIComponent(historyCursor)}`);
         const data = await response.json();
-        displayHistory(data.history);
+        historyCursor = data.next_cursor;
+        if (historyCache) {
+            const known = new Set(historyCache.items.map(item => item.id));
+            historyCache.items.push(...data.history.filter(item => !known.has(item.id)));
+            historyCache.cursor = historyCursor;
+            saveHistoryCache();
+        }
+        displayHistory(data.history, true, !!historyCursor);
     } catch (error) {
         console.error('加载历史记录失败:', error);
     }
 }
 
+// 全文检索历史记录，关键词为空时恢复完整列表
+async function searchHistory(query, offset) {
+    historyQuery = query.trim();
+    if (!historyQuery) {
+        loadHistory();
+        return;
+    }
+
+    try {
+        const response = await fetch(`/api/history/search?q=${encodeURIComponent(historyQuery)}&offset=${offset || 0}`);
+        const data = await response.json();
+        historySearchOffset = data.next_offset;
+        displayHistory(data.hits || [], !!offset, data.next_offset !== null);
+    } catch (error) {
+        console.error('检索历史记录失败:', error);
+    }
+}
+
 // 显示历史记录
-function displayHistory(history) {
+function displayHistory(history, append, hasMore) {
     const historyList = document.getElementById('historyList');
 
-    if (history.length === 0) {
-        historyList.innerHTML = '<p style="text-align: center; color: #7f8c8d; padding: 20px;">暂无历史记录</p>';
+    const oldMoreBtn = document.getElementById('historyMoreBtn');
+    if (oldMoreBtn) oldMoreBtn.remove();
+
+    if (!append && history.length === 0) {
+        const emptyText = historyQuery ? '没有找到相关记录' : '暂无历史记录';
+        historyList.innerHTML = `<p style="text-align: center; color: #7f8c8d; padding: 20px;">${emptyText}</p>`;
         return;
     }
 
-    historyList.innerHTML = '';
+    if (!append) {
+        historyList.innerHTML = '';
+    }
 
     history.forEach(record => {
         const item = document.createElement('div');
@@ -367,23 +628,45 @@ function displayHistory(history) {
                 </div>
             </div>
             <div class="history-item-time">${timeStr}</div>
-            <div class="history-item-context">${record.user_context || '无补充说明'}</div>
+            <div class="history-item-context">${record.snippet || record.styles.join(' | ')}</div>
         `;
 
         item.addEventListener('click', (e) => {
             if (!e.target.closest('button')) {
-                viewHistoryRecord(record);
+                viewHistoryRecord(record.id);
             }
         });
 
         historyList.appendChild(item);
     });
+
+    if (hasMore) {
+        const moreBtn = document.createElement('button');
+        moreBtn.id = 'historyMoreBtn';
+        moreBtn.className = 'btn-small btn-load-more';
+        moreBtn.textContent = '加载更多';
+        moreBtn.addEventListener('click', loadMoreHistory);
+        historyList.appendChild(moreBtn);
+    }
 }
 
 // 查看历史记录
-function viewHistoryRecord(record) {
-    displayResults(record.analyses);
-    toggleHistory();
+async function viewHistoryRecord(recordId) {
+    try {
+        const response = await fetch(`/api/history/${recordId}`);
+        const data = await response.json();
+
+        if (data.error) {
+            alert('加载失败: ' + data.error);
+            return;
+        }
+
+        displayResults(data.record.analyses);
+        toggleHistory();
+    } catch (error) {
+        console.error('加载历史记录失败:', error);
+        alert('加载失败: ' + error.message);
+    }
 }
 
 // 重命名历史记录
@@ -401,7 +684,7 @@ async function renameHistory(recordId) {
         });
 
         if (response.ok) {
-            loadHistory();
+            syncHistory();
         } else {
             alert('重命名失败');
         }
@@ -421,7 +704,7 @@ async function deleteHistory(recordId) {
         });
 
         if (response.ok) {
-            loadHistory();
+            syncHistory();
         } else {
             alert('删除失败');
         }
@@ -453,7 +736,7 @@ function switchTemplateType(type) {
     document.getElementById(`template${type.charAt(0).toUpperCase() + type.slice(1)}`).style.display = 'block';
 }
 
-function saveTemplate() {
+async function saveTemplate() {
     const textarea = document.getElementById(`template${currentTemplateType.charAt(0).toUpperCase() + currentTemplateType.slice(1)}`);
     const content = textarea.value.trim();
 
@@ -463,23 +746,58 @@ function saveTemplate() {
     }
 
     templates[currentTemplateType] = content;
+    // 旧 id 对应旧内容，取得新 id 之前分析请求发送模板内容
+    delete templateIds[currentTemplateType];
 
     // 保存到本地存储
     localStorage.setItem('reportTemplates', JSON.stringify(templates));
 
-    alert('模板保存成功！');
+    try {
+        await registerTemplate(currentTemplateType, content);
+        alert('模板保存成功！');
+    } catch (error) {
+        console.error('保存模板失败:', error);
+        alert('模板已保存在本地，同步到服务端失败: ' + error.message);
+    }
+}
+
+// 为本地模板内容取得服务端 id：id 由内容决定，重复保存是幂等的，不会修改或删除其他人使用的模板
+async function registerTemplate(type, content) {
+    const response = await fetch('/api/templates', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ type: type, content: content })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    templateIds[type] = data.template.id;
+}
+
+// 本地模板（localStorage）为准，逐个取得 id；失败时分析请求发送模板内容
+async function syncTemplateIds() {
+    for (const type of Object.keys(templates)) {
+        if (!templates[type]) continue;
+        try {
+            await registerTemplate(type, templates[type]);
+        } catch (error) {
+            console.error('同步模板失败:', error);
+        }
+    }
 }
 
-function loadTemplates() {
+async function loadTemplates() {
     const saved = localStorage.getItem('reportTemplates');
     if (saved) {
         templates = JSON.parse(saved);
-
-        // 填充到编辑器
-        if (templates.daily) document.getElementById('templateDaily').value = templates.daily;
-        if (templates.weekly) document.getElementById('templateWeekly').value = templates.weekly;
-        if (templates.monthly) document.getElementById('templateMonthly').value = templates.monthly;
     }
+    await syncTemplateIds();
+
+    // 填充到编辑器
+    if (templates.daily) document.getElementById('templateDaily').value = templates.daily;
+    if (templates.weekly) document.getElementById('templateWeekly').value = templates.weekly;
+    if (templates.monthly) document.getElementById('templateMonthly').value = templates.monthly;
 }
 
 // 简单的 Markdown 解析器
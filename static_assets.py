@@ -0,0 +1,77 @@
+"""静态资源构建 - 内容哈希命名与预压缩
+
+把 static/ 下的 css、js 复制为带内容哈希的文件名（如 css/style.3f2a9c1d0b7e.css），
+同时生成最高压缩级别的 .gz / .br 副本，写入 static/dist/，并记录到 manifest.json。
+文件名随内容变化，因此可以设置一年的 immutable 缓存，浏览器不再每次重新验证。
+
+用法：python static_assets.py [static 目录]
+"""
+import hashlib
+import json
+import os
+import sys
+
+from compression import ENCODINGS, SUFFIXES, compress
+
+
+# 需要构建的资源类型
+ASSET_EXTENSIONS = ('.css', '.js')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+
+def _write_atomic(path, data):
+    # 多个 worker 启动时可能同时构建，先写临时文件再替换
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _sources(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.join(static_folder, DIST_DIR)]
+        for name in sorted(files):
+            if name.endswith(ASSET_EXTENSIONS):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def build(static_folder):
+    """构建全部资源，返回清单 {原路径: 带哈希的路径}；内容未变化的文件不会重写"""
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for name, path in _sources(static_folder):
+        with open(path, 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        manifest[name] = hashed
+
+        target = os.path.join(dist, hashed)
+        if all(os.path.exists(target + SUFFIXES[e]) for e in ENCODINGS) and os.path.exists(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _write_atomic(target, data)
+        for encoding in ENCODINGS:
+            level = 11 if encoding == 'br' else 9
+            _write_atomic(target + SUFFIXES[encoding], compress(data, encoding, level))
+
+    os.makedirs(dist, exist_ok=True)
+    _write_atomic(os.path.join(dist, MANIFEST_NAME), json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_folder):
+    """读取构建清单，未构建时返回空字典"""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    for source, hashed in build(folder).items():
+        print(f'{source} -> {DIST_DIR}/{hashed}')
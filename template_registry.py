@@ -0,0 +1,174 @@
+"""报告模板注册表 - 服务端保存的自定义模板
+
+模板 id 为内容的 sha256 前缀：相同内容总是得到相同 id，保存是幂等的，
+修改内容会得到新 id。分析请求只需引用模板 id，不必每次上传完整模板，
+结果缓存的键也因此稳定。多个 worker 共享同一个 SQLite 文件。
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_templates_type ON templates(type, updated_at);
+"""
+
+TEMPLATE_COLUMNS = 'id, type, name, content, created_at, updated_at'
+
+# 模板类型：日报、周报、月报
+TEMPLATE_TYPES = ('daily', 'weekly', 'monthly')
+
+# 等待其它进程释放写锁的最长时间（秒）
+BUSY_TIMEOUT = 30
+
+
+class TemplateError(ValueError):
+    """模板参数不合法"""
+
+
+def template_id(content):
+    """模板内容对应的 id"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+
+class TemplateRegistry:
+    """模板的增删改查；按 id 读取的内容在进程内缓存（id 由内容决定，缓存不会过期）"""
+
+    def __init__(self, db_path, max_chars=20000):
+        self.db_path = db_path
+        self.max_chars = max_chars
+        self._local = threading.local()
+        self._contents = {}
+        with self._write() as conn:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _row_to_template(row):
+        return {
+            'id': row[0],
+            'type': row[1],
+            'name': row[2],
+            'content': row[3],
+            'created_at': row[4],
+            'updated_at': row[5]
+        }
+
+    def _check(self, template_type, content, name):
+        """检查参数，返回去掉首尾空白的内容"""
+        if not isinstance(template_type, str) or template_type not in TEMPLATE_TYPES:
+            raise TemplateError(f"模板类型应为 {' / '.join(TEMPLATE_TYPES)}")
+        if not isinstance(content, str):
+            raise TemplateError('模板内容应为字符串')
+        if not content.strip():
+            raise TemplateError('模板内容不能为空')
+        if not isinstance(name, str):
+            raise TemplateError('模板名称应为字符串')
+        content = content.strip()
+        if len(content) > self.max_chars:
+            raise TemplateError(f'模板内容不能超过 {self.max_chars} 个字符')
+        return content
+
+    def create(self, template_type, content, name=''):
+        """保存模板，返回模板；相同内容已存在时更新其类型和名称"""
+        name = '' if name is None else name
+        content = self._check(template_type, content, name)
+        tid = template_id(content)
+        now = time.time()
+        with self._write() as conn:
+            conn.execute(
+                'INSERT INTO templates (id, type, name, content, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET type = excluded.type, name = excluded.name, '
+                'updated_at = excluded.updated_at',
+                (tid, template_type, name, content, now, now)
+            )
+        self._contents[tid] = content
+        return self.get(tid)
+
+    def get(self, tid):
+        """按 id 获取模板，不存在返回 None"""
+        row = self._conn().execute(
+            f'SELECT {TEMPLATE_COLUMNS} FROM templates WHERE id = ?', (tid,)
+        ).fetchone()
+        return self._row_to_template(row) if row else None
+
+    def content(self, tid):
+        """按 id 获取模板内容（分析请求使用），不存在返回 None"""
+        cached = self._contents.get(tid)
+        if cached is not None:
+            return cached
+        row = self._conn().execute('SELECT content FROM templates WHERE id = ?', (tid,)).fetchone()
+        if row is None:
+            return None
+        self._contents[tid] = row[0]
+        return row[0]
+
+    def list(self, template_type=None):
+        """全部模板（最近更新的在前），可按类型筛选"""
+        rows = self._conn().execute(
+            f'SELECT {TEMPLATE_COLUMNS} FROM templates WHERE (? IS NULL OR type = ?) ORDER BY updated_at DESC',
+            (template_type, template_type)
+        ).fetchall()
+        return [self._row_to_template(row) for row in rows]
+
+    def update(self, tid, template_type=None, content=None, name=None):
+        """修改模板，返回修改后的模板，不存在返回 None
+
+        内容变化时 id 随之变化：新内容保存为新模板，原模板保留，
+        其它页面或用户仍在使用的旧 id 不会失效。
+        """
+        current = self.get(tid)
+        if current is None:
+            return None
+        template_type = template_type if template_type is not None else current['type']
+        name = name if name is not None else current['name']
+        content = self._check(template_type, content if content is not None else current['content'], name)
+
+        new_id = template_id(content)
+        now = time.time()
+        with self._write() as conn:
+            conn.execute(
+                'INSERT INTO templates (id, type, name, content, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET type = excluded.type, name = excluded.name, '
+                'updated_at = excluded.updated_at',
+                (new_id, template_type, name, content, current['created_at'], now)
+            )
+        self._contents[new_id] = content
+        return self.get(new_id)
+
+    def delete(self, tid):
+        """删除模板，返回是否存在；已引用该 id 的结果缓存不受影响"""
+        with self._write() as conn:
+            deleted = conn.execute('DELETE FROM templates WHERE id = ?', (tid,)).rowcount > 0
+        self._contents.pop(tid, None)
+        return deleted